@@ -2,15 +2,25 @@
 # GANAPATHI FINANCE – FULL APP (BUG FIXED + STABLE)
 # =============================================================================
 
-import os, io, hashlib
-from datetime import date, timedelta
+import os, hashlib, tempfile
+from datetime import date, datetime, timedelta
 
 import streamlit as st
-import psycopg2
 import pandas as pd
 from dotenv import load_dotenv
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfgen import canvas
+
+import db
+from cache import TTLCache, notify
+from statements import loan_pdf, statement_version, export_statements, STATEMENT_CACHE_TTL
+from exports import EXPORTS, WRITERS
+import imports
+from maintenance import ensure_partitions
+from loans import create_loan, update_loan, close_loan, delete_customer, save_payments
+from queries import (
+    customer_schedules, customers_page, customers_estimate, search_customers,
+    report_summary, report_pending, dashboard_kpis, collection_day, audit_log,
+    overdue_loans, OVERDUE_BUCKETS,
+)
 
 # -----------------------------------------------------------------------------
 # ENV
@@ -22,6 +32,10 @@ load_dotenv()
 # -----------------------------------------------------------------------------
 st.set_page_config(page_title="Ganapathi Finance", layout="wide", initial_sidebar_state="collapsed")
 APP_NAME = "🪔 Ganapathi Finance"
+PAGE_SIZES = [10, 25, 50, 100]
+CUSTOMERS_PAGE_SIZE = int(os.getenv("CUSTOMERS_PAGE_SIZE", "25"))
+# users who see the per-rerun query timings in the sidebar
+ADMIN_USERS = set(os.getenv("ADMIN_USERS", "admin").split(","))
 
 # -----------------------------------------------------------------------------
 # FORCE WHITE UI
@@ -41,738 +55,1023 @@ h1,h2,h3,h4 { font-family: Segoe UI, system-ui; }
 # -----------------------------------------------------------------------------
 # DATABASE
 # -----------------------------------------------------------------------------
+@st.cache_resource
+def get_pool():
+    # one pool per server process, shared by every session
+    pool = db.get_pool(sslmode="require", connect_timeout=5)
+    # make sure the coming months have their daily_collections partitions
+    # (the daily maintenance.py --partitions run does the same)
+    con = pool.getconn()
+    try:
+        ensure_partitions(con.cursor())
+        con.commit()
+    except Exception:
+        # not fatal: rows for a missing month go to the default partition
+        con.rollback()
+    finally:
+        con.close()
+    return pool
+
 def get_conn():
     try:
-        return psycopg2.connect(os.getenv("DATABASE_URL"), sslmode="require", connect_timeout=5)
+        return get_pool().getconn()
     except Exception as e:
         st.error("Database connection failed")
         st.code(str(e))
-        st.stop()
+        stop()
+
+def get_read_conn():
+    # read-only pages: the replica when DATABASE_REPLICA_URL is set, unless it
+    # has not yet replayed this session's last write or the last invalidation
+    # this process received (db.read_connection falls back to the primary)
+    min_lsn = max(st.session_state.get("write_lsn", 0), get_cache().listener.lsn)
+    try:
+        return db.read_connection(get_pool(), min_lsn, sslmode=db.REPLICA_SSLMODE, connect_timeout=5)
+    except Exception as e:
+        st.error("Database connection failed")
+        st.code(str(e))
+        stop()
+
+@st.cache_resource
+def get_cache():
+    # process-wide, like the pool, so every session shares the results;
+    # writes made by other app processes arrive through LISTEN/NOTIFY
+    cache = TTLCache()
+    cache.listen(os.getenv("DATABASE_URL"), sslmode="require", connect_timeout=5)
+    return cache
+
+def cached_read(query, *args, tags=(), ttl=None, replica=False):
+    """Run queries.<query>(con, *args) through the cache; a connection is
+    only checked out on a miss (from the read replica with replica=True)."""
+    def load():
+        con = get_read_conn() if replica else get_conn()
+        try:
+            return query(con, *args)
+        finally:
+            con.close()
+    return get_cache().get_or_load((query.__name__, args), load, ttl=ttl, tags=tags)
+
+def invalidate(*tags, con=None):
+    get_cache().invalidate(*tags)
+    # called after every write with the (still open) connection that made
+    # it: until the replica has replayed this far, this session's reads go
+    # to the primary
+    if db.REPLICA_URL and con is not None:
+        st.session_state.write_lsn = db.primary_lsn(con)
+
+def pool_stats_panel():
+    s = get_pool().stats()
+    with st.sidebar.expander("🔌 DB Pool"):
+        st.write(f"In use: **{s['in_use']}** / {s['max']} | Idle: **{s['idle']}**")
+        st.write(f"Checkouts: {s['checkouts']} | Waited: {s['waits']} | Timeouts: {s['timeouts']}")
+        st.write(f"Avg wait: {s['avg_wait_ms']} ms | Max wait: {s['max_wait_ms']} ms")
+        st.write(f"Reconnects: {s['reconnects']}")
+        if db.REPLICA_URL:
+            r = db.replica_stats
+            st.write(f"Replica: {r['reads']} reads | {r['fallbacks']} to primary | {r['errors']} errors")
+        c = get_cache().stats()
+        st.write(f"Cache: {c['entries']} entries | {c['hits']} hits / {c['misses']} misses")
+        l = get_cache().listener
+        st.write(
+            f"Invalidations: {l.received} received | "
+            f"{'listening' if l.connected else 'reconnecting'} ({l.reconnects} reconnects)"
+        )
+
+def query_timings_panel(box, trace):
+    with box.container(), st.expander("⏱ Query Timings"):
+        st.write(f"Page: **{trace.page}** | Queries: **{trace.count}**")
+        st.write(
+            f"DB: **{trace.db_ms:.0f} ms** | Render: **{trace.total_ms - trace.db_ms:.0f} ms** "
+            f"| Total: {trace.total_ms:.0f} ms"
+        )
+        if trace.queries:
+            df = pd.DataFrame(trace.by_fingerprint()).round({"ms": 1})
+            st.dataframe(df, use_container_width=True, hide_index=True)
 
 def hash_password(p): return hashlib.sha256(p.encode()).hexdigest()
 
 # -----------------------------------------------------------------------------
-# PDF
+# DOWNLOAD FILES
 # -----------------------------------------------------------------------------
-def loan_pdf(customer, loan, hist):
-    buf = io.BytesIO()
-    pdf = canvas.Canvas(buf, pagesize=A4)
-    y = A4[1] - 40
-
-    pdf.setFont("Helvetica-Bold", 16)
-    pdf.drawString(40, y, "GANAPATHI FINANCE – LOAN STATEMENT")
-    y -= 30
-
-    pdf.setFont("Helvetica", 10)
-    pdf.drawString(40, y, f"Customer: {customer['name']} ({customer['customer_code']})")
-    y -= 14
-    pdf.drawString(40, y, f"Loan Amount: ₹{loan['total_amount']} | Status: {loan['status']}")
-    y -= 20
-
-    pdf.setFont("Helvetica-Bold", 10)
-    pdf.drawString(40, y, "Date")
-    pdf.drawString(160, y, "Due")
-    pdf.drawString(230, y, "Paid")
-    pdf.drawString(300, y, "Status")
-    y -= 12
-
-    pdf.setFont("Helvetica", 10)
-    for _, r in hist.iterrows():
-        if y < 60:
-            pdf.showPage()
-            y = A4[1] - 40
-        pdf.drawString(40, y, str(r["collection_date"]))
-        pdf.drawString(160, y, f"₹{r['amount_due']}")
-        pdf.drawString(230, y, f"₹{r['amount_paid']}")
-        pdf.drawString(300, y, r["status"])
-        y -= 12
-
-    pdf.save()
-    buf.seek(0)
-    return buf
+# Exports are written to a temp dir owned by the session: it is removed when
+# the session goes away, and preparing a download again replaces the file
+# the session had for it.
+def download_path(slot, ext):
+    tmp = st.session_state.get("download_dir")
+    if tmp is None:
+        tmp = st.session_state.download_dir = tempfile.TemporaryDirectory(prefix="finance_")
+    old = st.session_state.pop(f"download_{slot}", None)
+    if old and os.path.exists(old):
+        os.remove(old)
+    path = os.path.join(tmp.name, f"{slot}.{ext}")
+    st.session_state[f"download_{slot}"] = path
+    return path
+
+def read_file(path):
+    with open(path, "rb") as f:
+        return f.read()
 
 # -----------------------------------------------------------------------------
-# SESSION
+# PDF
 # -----------------------------------------------------------------------------
-st.session_state.setdefault("logged_in", False)
-st.session_state.setdefault("page", "login")
-st.session_state.setdefault("customer_id", None)
-
-def go(p): st.session_state.page = p
-
-# =============================================================================
-# LOGIN
-# =============================================================================
-if not st.session_state.logged_in:
-    st.markdown(f"# {APP_NAME}")
-    u = st.text_input("Username")
-    p = st.text_input("Password", type="password")
-
-    if st.button("Login", use_container_width=True):
-        con = get_conn(); cur = con.cursor()
-        cur.execute("SELECT password_hash FROM users WHERE username=%s", (u,))
-        r = cur.fetchone()
-        con.close()
-
-        if r and r[0] == hash_password(p):
-            st.session_state.logged_in = True
-            go("dashboard"); st.rerun()
-        else:
-            st.error("Invalid login")
-    st.stop()
+def statement_data(customer, loan, hist):
+    """Deferred download payload: the PDF is rendered only when the button is
+    clicked, and reused until the loan or its schedule changes."""
+    cache = get_cache()
+    key = ("loan_statement", int(loan["id"]), statement_version(customer, loan, hist))
+
+    def render():
+        return cache.get_or_load(
+            key, lambda: loan_pdf(customer, loan, hist).getvalue(),
+            ttl=STATEMENT_CACHE_TTL, tags=(f"loan:{loan['id']}",)
+        )
+    return render
 
-# =============================================================================
-# DASHBOARD
-# =============================================================================
-if st.session_state.page == "dashboard":
-    st.markdown(f"# {APP_NAME}")
-
-    con = get_conn()
-    today = date.today()
-    k = pd.read_sql("""
-        SELECT
-        (SELECT COUNT(*) FROM customers) customers,
-        (SELECT COUNT(*) FROM loans WHERE status='Active') active,
-        (SELECT COALESCE(SUM(amount_paid),0) FROM daily_collections WHERE collection_date=%s) collected
-    """, con, params=(today,)).iloc[0]
+# -----------------------------------------------------------------------------
+# DAILY COLLECTION
+# -----------------------------------------------------------------------------
+# The selected day's rows are kept in the session. Saving one row reruns
+# only that row's fragment: the stored rows are patched with the new amount
+# and the KPI strip is redrawn from them, so nothing is refetched and a save
+# costs the same whether 10 or 1000 customers are due.
+#
+# The copy is stamped with the cache generation of the "collections" tag:
+# a full run of the page fetches the day again once any write has been
+# heard of (other sessions, other app processes via LISTEN/NOTIFY, loan
+# edits). Row fragments and save callbacks work on the held copy as it is.
+def collection_rows(day, refresh=False):
+    gen = get_cache().generation("collections")
+    held = st.session_state.get("collection_rows")
+    if refresh or held is None or held[:2] != (day, gen):
+        con = get_conn()
+        try:
+            held = (day, gen, collection_day(con, day))
+        finally:
+            con.close()
+        st.session_state.collection_rows = held
+    return held[2]
+
+def held_collection_rows():
+    return st.session_state.collection_rows[2]
+
+def set_paid(df, index, amounts):
+    """Mirror what save_payments wrote onto the held rows."""
+    amounts = [int(a) for a in amounts]
+    df.loc[index, "amount_paid"] = amounts
+    df.loc[index, "status"] = ["Paid" if a > 0 else "Pending" for a in amounts]
+
+def collection_kpis(box, df):
+    expected = int(df["amount_due"].sum())
+    collected = int(df["amount_paid"].sum())
+    with box.container():
+        k1, k2, k3 = st.columns(3)
+        k1.metric("Expected", f"₹{expected}")
+        k2.metric("Collected", f"₹{collected}")
+        k3.metric("Pending", f"₹{expected - collected}")
+
+def fragment_trace():
+    # a fragment rerun skips the top of the script, so its queries would
+    # otherwise be added to the last full run's (finished) trace
+    current = db.current_trace()
+    if current is None or current.finished is not None:
+        db.start_trace(f"{st.session_state.page} (fragment)")
+
+def save_collection_row(day, i):
+    # button callback: runs before the fragment redraws, so the row below
+    # already shows the saved amount
+    fragment_trace()
+    df = held_collection_rows()
+    loan_id = int(df.at[i, "loan_id"])
+    amt = st.session_state[f"amt_{loan_id}_{day}"]
+
+    con = get_conn(); cur = con.cursor()
+    loan_ids = save_payments(cur, [(loan_id, day, amt)], user=st.session_state.get("username"))
+    con.commit()
+    invalidate("collections", *(f"loan:{lid}" for lid in loan_ids), con=con)
     con.close()
+    set_paid(df, [i], [amt])
+    st.session_state.collection_saved = i
 
-    c1,c2,c3 = st.columns(3)
-    c1.markdown(f"<div class='kpi blue'><h4>Customers</h4><h2>{k.customers}</h2></div>",True)
-    c2.markdown(f"<div class='kpi orange'><h4>Active Loans</h4><h2>{k.active}</h2></div>",True)
-    c3.markdown(f"<div class='kpi green'><h4>Today</h4><h2>₹{k.collected}</h2></div>",True)
+@st.fragment
+def collection_row(day, i, kpi_box):
+    fragment_trace()
+    df = held_collection_rows()
+    r = df.loc[i]
 
-    st.divider()
-    b1,b2,b3,b4 = st.columns(4)
+    if st.session_state.get("collection_saved") == i:
+        del st.session_state.collection_saved
+        collection_kpis(kpi_box, df)
 
-    with b1:
-        st.markdown("<div class='big-btn'>",True)
-        if st.button("➕ NEW CUSTOMER",use_container_width=True):
-            go("new_customer"); st.rerun()
-        st.markdown("</div>",True)
+    paid = r["amount_paid"] > 0
+    bg = "#dcfce7" if paid else "#fee2e2"
 
-    with b2:
-        st.markdown("<div class='big-btn'>", unsafe_allow_html=True)
-        if st.button("👥 CUSTOMERS", use_container_width=True):
-            go("customers")
-            st.rerun()
-        st.markdown("</div>", unsafe_allow_html=True)
+    st.markdown(
+        f"<div class='card' style='background:{bg}'>",
+        unsafe_allow_html=True
+    )
 
+    a, b, c, d, e = st.columns([2, 3, 2, 2, 1])
 
-    with b3:
-        st.markdown("<div class='big-btn'>",True)
-        if st.button("💰 DAILY COLLECTION",use_container_width=True):
-            go("collection"); st.rerun()
-        st.markdown("</div>",True)
+    a.write(f"**{r['customer_code']}**")
+    b.write(f"**{r['name']}**")
+    c.write(f"Due ₹{r['amount_due']}")
 
-    with b4:
-        st.markdown("<div class='big-btn'>",True)
-        if st.button("📊 REPORTS",use_container_width=True):
-            go("reports"); st.rerun()
-        st.markdown("</div>",True)
+    d.number_input(
+        "Paid",
+        min_value=0,
+        value=int(r["amount_paid"]),
+        key=f"amt_{r['loan_id']}_{day}",
+        label_visibility="collapsed"
+    )
 
-# =============================================================================
-# NEW CUSTOMER
-# =============================================================================
-elif st.session_state.page == "new_customer":
-    st.button("⬅ Back", on_click=lambda: go("dashboard"))
-    st.markdown("## ➕ New Customer")
-
-    with st.form("new_customer"):
-        code = st.text_input("Customer ID")
-        name = st.text_input("Name")
-        mobile = st.text_input("Mobile")
-        address = st.text_area("Address")
-
-        total = st.number_input("Loan Amount", min_value=0)
-        daily = st.number_input("Daily Amount", min_value=1)
-        days = st.number_input("Days", min_value=1, value=100)
-        loan_date = st.date_input("Loan Date", value=date.today())
-
-        submit = st.form_submit_button("CREATE")
-
-    if submit:
-        start = loan_date + timedelta(days=1)
-        end = start + timedelta(days=days-1)
-
-        con = get_conn(); cur = con.cursor()
-        cur.execute("""
-            INSERT INTO customers (customer_code,name,mobile1,address)
-            VALUES (%s,%s,%s,%s) RETURNING id
-        """,(code,name,mobile,address))
-        cid = cur.fetchone()[0]
-
-        cur.execute("""
-            INSERT INTO loans (customer_id,total_amount,daily_amount,duration_days,
-                               loan_date,start_date,end_date,status)
-            VALUES (%s,%s,%s,%s,%s,%s,%s,'Active')
-        """,(cid,total,daily,days,loan_date,start,end))
-
-        for i in range(days):
-            cur.execute("""
-                INSERT INTO daily_collections (loan_id,collection_date,amount_due,amount_paid,status)
-                VALUES ((SELECT id FROM loans WHERE customer_id=%s ORDER BY id DESC LIMIT 1),
-                        %s,%s,0,'Pending')
-            """,(cid,start+timedelta(days=i),daily))
+    e.button("✔", key=f"save_{r['loan_id']}_{day}", on_click=save_collection_row, args=(day, i))
 
-        con.commit(); con.close()
-        st.success("Customer created")
-        go("dashboard"); st.rerun()
+    st.markdown("</div>", unsafe_allow_html=True)
 
-# =============================================================================
-# CUSTOMERS PAGE
-# =============================================================================
-elif st.session_state.page == "customers":
-
-    st.button("⬅ Back", on_click=lambda: go("dashboard"))
-    st.markdown("## 👥 Customers")
-
-    search = st.text_input("🔍 Search by Name or Customer ID")
-
-    con = get_conn()
-    df = pd.read_sql("""
-        SELECT
-            c.id,
-            c.customer_code,
-            c.name,
-            c.mobile1,
-            COUNT(l.id) AS total_loans
-        FROM customers c
-        LEFT JOIN loans l ON c.id = l.customer_id
-        GROUP BY c.id
-        ORDER BY c.created_at DESC
-    """, con)
-    con.close()
+# -----------------------------------------------------------------------------
+# SESSION
+# -----------------------------------------------------------------------------
+st.session_state.setdefault("logged_in", False)
+st.session_state.setdefault("page", "login")
+st.session_state.setdefault("customer_id", None)
 
-    if search:
-        s = search.lower()
-        df = df[
-            df["name"].str.lower().str.contains(s) |
-            df["customer_code"].str.lower().str.contains(s)
-        ]
-
-    if df.empty:
-        st.info("No customers found")
-    else:
-        for _, r in df.iterrows():
-            st.markdown("<div class='card'>", unsafe_allow_html=True)
+def go(p): st.session_state.page = p
 
-            a, b = st.columns([4, 1])
-            a.markdown(f"### {r['name']} ({r['customer_code']})")
-            a.write(f"📞 {r['mobile1']} | Loans: {r['total_loans']}")
+# every query of this rerun is timed against the page it ran under
+trace = db.start_trace(st.session_state.page)
+# the timings panel (admins only) is drawn into this slot once the run ends,
+# whichever way it ends
+timings_box = st.sidebar.empty()
+
+def finish_run():
+    if trace.finished is not None:
+        return
+    trace.finish()
+    if st.session_state.get("username") in ADMIN_USERS:
+        query_timings_panel(timings_box, trace)
+
+def stop():
+    # nothing can be drawn once st.stop() is called, so the timings go first
+    finish_run()
+    st.stop()
 
-            if b.button("OPEN", key=f"cust_{r['id']}"):
-                st.session_state.customer_id = r["id"]
-                go("customer_dashboard")
+try:
+    # =========================================================================
+    # LOGIN
+    # =========================================================================
+    if not st.session_state.logged_in:
+        st.markdown(f"# {APP_NAME}")
+        u = st.text_input("Username")
+        p = st.text_input("Password", type="password")
+
+        if st.button("Login", use_container_width=True):
+            con = get_conn(); cur = con.cursor()
+            cur.execute("SELECT password_hash FROM users WHERE username=%s", (u,))
+            r = cur.fetchone()
+            con.close()
+
+            if r and r[0] == hash_password(p):
+                st.session_state.logged_in = True
+                st.session_state.username = u
+                go("dashboard"); st.rerun()
+            else:
+                st.error("Invalid login")
+        stop()
+
+    # =========================================================================
+    # DASHBOARD
+    # =========================================================================
+    if st.session_state.page == "dashboard":
+        st.markdown(f"# {APP_NAME}")
+
+        k = cached_read(dashboard_kpis, date.today(), tags=("customers", "loans", "summaries"), replica=True)
+
+        c1,c2,c3 = st.columns(3)
+        c1.markdown(f"<div class='kpi blue'><h4>Customers</h4><h2>{k.customers}</h2></div>",True)
+        c2.markdown(f"<div class='kpi orange'><h4>Active Loans</h4><h2>{k.active}</h2></div>",True)
+        c3.markdown(f"<div class='kpi green'><h4>Today</h4><h2>₹{k.collected}</h2></div>",True)
+        if pd.notna(k.as_of):
+            st.caption(f"Collections as of {k.as_of:%H:%M}")
+
+        pool_stats_panel()
+
+        st.divider()
+        b1,b2,b3,b4 = st.columns(4)
+
+        with b1:
+            st.markdown("<div class='big-btn'>",True)
+            if st.button("➕ NEW CUSTOMER",use_container_width=True):
+                go("new_customer"); st.rerun()
+            st.markdown("</div>",True)
+
+        with b2:
+            st.markdown("<div class='big-btn'>", unsafe_allow_html=True)
+            if st.button("👥 CUSTOMERS", use_container_width=True):
+                go("customers")
                 st.rerun()
-
             st.markdown("</div>", unsafe_allow_html=True)
 
 
-# =============================================================================
-# CUSTOMER DASHBOARD (FULL PREVIEW + EDIT + DELETE)
-# =============================================================================
-elif st.session_state.page == "customer_dashboard":
+        with b3:
+            st.markdown("<div class='big-btn'>",True)
+            if st.button("💰 DAILY COLLECTION",use_container_width=True):
+                # always start from fresh rows when the page is opened
+                st.session_state.pop("collection_rows", None)
+                go("collection"); st.rerun()
+            st.markdown("</div>",True)
+
+        with b4:
+            st.markdown("<div class='big-btn'>",True)
+            if st.button("📊 REPORTS",use_container_width=True):
+                go("reports"); st.rerun()
+            st.markdown("</div>",True)
+
+        s1, s2, s3, _ = st.columns(4)
+        if s1.button("🧾 AUDIT LOG", use_container_width=True):
+            go("audit"); st.rerun()
+        if s2.button("📥 BULK IMPORT", use_container_width=True):
+            go("import"); st.rerun()
+        if s3.button("🚨 OVERDUE", use_container_width=True):
+            go("overdue"); st.rerun()
+
+    # =========================================================================
+    # NEW CUSTOMER
+    # =========================================================================
+    elif st.session_state.page == "new_customer":
+        st.button("⬅ Back", on_click=lambda: go("dashboard"))
+        st.markdown("## ➕ New Customer")
+
+        with st.form("new_customer"):
+            code = st.text_input("Customer ID")
+            name = st.text_input("Name")
+            mobile = st.text_input("Mobile")
+            address = st.text_area("Address")
+
+            total = st.number_input("Loan Amount", min_value=0)
+            daily = st.number_input("Daily Amount", min_value=1)
+            days = st.number_input("Days", min_value=1, value=100)
+            loan_date = st.date_input("Loan Date", value=date.today())
+
+            submit = st.form_submit_button("CREATE")
+
+        if submit:
+            con = get_conn(); cur = con.cursor()
+            cur.execute("""
+                INSERT INTO customers (customer_code,name,mobile1,address)
+                VALUES (%s,%s,%s,%s) RETURNING id
+            """,(code,name,mobile,address))
+            cid = cur.fetchone()[0]
 
-    st.button("⬅ Back", on_click=lambda: go("customers"))
+            create_loan(cur, cid, total, daily, days, loan_date)
+            notify(cur, "customers")
 
-    cid = st.session_state.customer_id
-    con = get_conn()
+            con.commit()
+            invalidate("customers", "loans", "collections", con=con)
+            con.close()
+            st.success("Customer created")
+            go("dashboard"); st.rerun()
 
-    customer = pd.read_sql(
-        "SELECT * FROM customers WHERE id=%s",
-        con, params=(cid,)
-    ).iloc[0]
+    # =========================================================================
+    # CUSTOMERS PAGE
+    # =========================================================================
+    elif st.session_state.page == "customers":
 
-    loans = pd.read_sql(
-        "SELECT * FROM loans WHERE customer_id=%s ORDER BY id DESC",
-        con, params=(cid,)
-    )
+        st.button("⬅ Back", on_click=lambda: go("dashboard"))
+        st.markdown("## 👥 Customers")
 
-    # -------------------------------------------------------------------------
-    # CUSTOMER PREVIEW
-    # -------------------------------------------------------------------------
-    st.markdown(f"# 👤 {customer['name']} ({customer['customer_code']})")
+        search = st.text_input("🔍 Search by Name, Customer ID or Mobile").strip()
+        page_size = st.selectbox(
+            "Per page", PAGE_SIZES,
+            index=PAGE_SIZES.index(CUSTOMERS_PAGE_SIZE) if CUSTOMERS_PAGE_SIZE in PAGE_SIZES else 0
+        )
 
-    st.markdown("<div class='card'>", unsafe_allow_html=True)
-    c1, c2, c3 = st.columns(3)
-    c1.write(f"📞 **Mobile 1:** {customer['mobile1']}")
-    c2.write(f"📞 **Mobile 2:** {customer.get('second_mobile','-') or '-'}")
-    c3.write(f"🪪 **Aadhar:** {customer.get('aadhar_number','-') or '-'}")
+        # keyset cursors of the pages visited so far; reset when the query changes
+        query_key = (search, page_size)
+        if st.session_state.get("cust_query") != query_key:
+            st.session_state.cust_query = query_key
+            st.session_state.cust_cursors = [None]
 
-    c4, c5 = st.columns(2)
-    c4.write(f"👥 **Referral:** {customer.get('referral_name','-') or '-'}")
-    c5.write(f"🏠 **Address:** {customer['address']}")
-    st.markdown("</div>", unsafe_allow_html=True)
+        cursors = st.session_state.cust_cursors
 
-    # -------------------------------------------------------------------------
-    # EDIT CUSTOMER DETAILS
-    # -------------------------------------------------------------------------
-    with st.expander("✏️ Edit Customer Details"):
-        with st.form("edit_customer"):
-            name = st.text_input("Name", value=customer["name"])
-            aadhar = st.text_input("Aadhar", value=customer.get("aadhar_number",""))
-            mobile1 = st.text_input("Mobile 1", value=customer["mobile1"])
-            mobile2 = st.text_input("Mobile 2", value=customer.get("second_mobile",""))
-            referral = st.text_input("Referral", value=customer.get("referral_name",""))
-            address = st.text_area("Address", value=customer["address"])
-
-            if st.form_submit_button("SAVE CUSTOMER"):
-                cur = con.cursor()
-                cur.execute("""
-                    UPDATE customers
-                    SET name=%s, aadhar_number=%s,
-                        mobile1=%s, second_mobile=%s,
-                        referral_name=%s, address=%s
-                    WHERE id=%s
-                """, (name, aadhar, mobile1, mobile2, referral, address, cid))
-                con.commit()
-                st.success("Customer updated successfully")
-                st.rerun()
+        if search:
+            df, has_next = cached_read(
+                search_customers, search, page_size, tags=("customers", "loans"), replica=True
+            ), False
+        else:
+            df, has_next = cached_read(customers_page, page_size, cursors[-1], tags=("customers", "loans"), replica=True)
+            total = cached_read(customers_estimate, tags=("customers",), replica=True)
 
-    # -------------------------------------------------------------------------
-    # LOANS SECTION
-    # -------------------------------------------------------------------------
-    st.markdown("## 💰 Loan History")
+        if df.empty:
+            st.info("No customers found")
+        else:
+            if search:
+                st.caption(f"Top {len(df)} matches")
+            else:
+                first = (len(cursors) - 1) * page_size + 1
+                st.caption(f"Showing {first}–{first + len(df) - 1} of ~{total} customers")
 
-    active_loan_exists = False
+            for _, r in df.iterrows():
+                st.markdown("<div class='card'>", unsafe_allow_html=True)
 
-    for _, loan in loans.iterrows():
+                a, b = st.columns([4, 1])
+                a.markdown(f"### {r['name']} ({r['customer_code']})")
+                a.write(f"📞 {r['mobile1']} | Loans: {r['total_loans']}")
 
-        hist = pd.read_sql("""
-            SELECT collection_date, amount_due, amount_paid, status
-            FROM daily_collections
-            WHERE loan_id=%s
-            ORDER BY collection_date
-        """, con, params=(loan["id"],))
+                if b.button("OPEN", key=f"cust_{r['id']}"):
+                    st.session_state.customer_id = r["id"]
+                    go("customer_dashboard")
+                    st.rerun()
 
-        paid = hist["amount_paid"].sum()
-        remaining = loan["total_amount"] - paid
-        collection_started = paid > 0
+                st.markdown("</div>", unsafe_allow_html=True)
 
-        if loan["status"] == "Active":
-            active_loan_exists = True
+        p1, _, p2 = st.columns([1, 4, 1])
+        if p1.button("⬅ Prev", disabled=len(cursors) == 1, use_container_width=True):
+            cursors.pop()
+            st.rerun()
+        if p2.button("Next ➡", disabled=not has_next, use_container_width=True):
+            last = df.iloc[-1]
+            cursors.append((last["created_at"], last["id"]))
+            st.rerun()
 
-        st.markdown("<div class='card'>", unsafe_allow_html=True)
-        st.subheader(f"Loan ID: {loan['id']}")
 
-        # ---------------- KPIs ----------------
-        k1, k2, k3, k4, k5 = st.columns(5)
-        k1.metric("Total", f"₹{loan['total_amount']}")
-        k2.metric("Paid", f"₹{paid}")
-        k3.metric("Remaining", f"₹{remaining}")
-        k4.metric("Status", loan["status"])
-        k5.metric(
-            "Collection",
-            "Started" if collection_started else "Not Started"
-        )
+    # =========================================================================
+    # CUSTOMER DASHBOARD (FULL PREVIEW + EDIT + DELETE)
+    # =========================================================================
+    elif st.session_state.page == "customer_dashboard":
 
-        st.write(
-            f"📅 {loan['start_date']} → {loan['end_date']} | "
-            f"💵 Daily ₹{loan['daily_amount']} | "
-            f"🗓 {loan['duration_days']} days"
-        )
+        st.button("⬅ Back", on_click=lambda: go("customers"))
 
-        # ---------------- DAILY COLLECTION TABLE ----------------
-        st.dataframe(
-            hist.style.applymap(
-                lambda x: "background-color:#dcfce7" if x == "Paid" else "",
-                subset=["status"]
-            ),
-            use_container_width=True,
-            height=260
-        )
+        cid = st.session_state.customer_id
+        con = get_conn()
 
-        st.download_button(
-            "📄 Download Loan Statement",
-            loan_pdf(customer, loan, hist),
-            f"{customer['name']}_loan_{loan['id']}.pdf"
+        customer = pd.read_sql(
+            "SELECT * FROM customers WHERE id=%s",
+            con, params=(cid,)
+        ).iloc[0]
+
+        loans = pd.read_sql(
+            "SELECT * FROM loans WHERE customer_id=%s ORDER BY id DESC",
+            con, params=(cid,)
         )
 
-        # ---------------- EDIT LOAN ----------------
-        if loan["status"] == "Active" and not collection_started:
-            with st.expander("✏️ Edit Loan (Before Collection Starts)"):
-                with st.form(f"edit_loan_{loan['id']}"):
-                    total = st.number_input("Total Amount", value=loan["total_amount"])
-                    interest = st.number_input("Interest", value=loan["interest"])
-                    actual = st.number_input("Actual Given", value=loan["actual_given"])
-                    daily = st.number_input("Daily Amount", value=loan["daily_amount"])
-                    days = st.number_input("Duration (Days)", value=loan["duration_days"])
-                    loan_date = st.date_input("Loan Date", value=loan["loan_date"])
-
-                    if st.form_submit_button("UPDATE LOAN"):
-                        start = loan_date + timedelta(days=1)
-                        end = start + timedelta(days=days - 1)
-
-                        cur = con.cursor()
-                        cur.execute("""
-                            UPDATE loans
-                            SET total_amount=%s, interest=%s, actual_given=%s,
-                                daily_amount=%s, duration_days=%s,
-                                loan_date=%s, start_date=%s, end_date=%s
-                            WHERE id=%s
-                        """, (total, interest, actual, daily, days, loan_date, start, end, loan["id"]))
-
-                        cur.execute("DELETE FROM daily_collections WHERE loan_id=%s", (loan["id"],))
-                        for i in range(days):
-                            cur.execute("""
-                                INSERT INTO daily_collections
-                                (loan_id, collection_date, amount_due, amount_paid, status)
-                                VALUES (%s,%s,%s,0,'Pending')
-                            """, (loan["id"], start + timedelta(days=i), daily))
-
-                        con.commit()
-                        st.success("Loan updated")
-                        st.rerun()
-
-        # ---------------- CLOSE LOAN ----------------
-        if loan["status"] == "Active":
-            with st.expander("🔒 Close Loan"):
-                with st.form(f"close_{loan['id']}"):
-                    close_amt = st.number_input("Remaining Amount Collected", value=remaining)
-                    close_date = st.date_input("Close Date", value=date.today())
-
-                    if st.form_submit_button("CLOSE LOAN"):
-                        cur = con.cursor()
-                        cur.execute("UPDATE loans SET status='Closed' WHERE id=%s", (loan["id"],))
-                        cur.execute("""
-                            UPDATE daily_collections
-                            SET amount_paid=%s, status='Paid'
-                            WHERE id = (
-                                SELECT id FROM daily_collections
-                                WHERE loan_id=%s
-                                ORDER BY collection_date DESC
-                                LIMIT 1
-                            )
-                        """, (close_amt, loan["id"]))
-                        cur.execute("""
-                            DELETE FROM daily_collections
-                            WHERE loan_id=%s AND collection_date > %s
-                        """, (loan["id"], close_date))
-                        con.commit()
-                        st.success("Loan closed successfully")
-                        st.rerun()
+        schedules, no_schedule = customer_schedules(con, cid)
 
-        st.markdown("</div>", unsafe_allow_html=True)
+        # ---------------------------------------------------------------------
+        # CUSTOMER PREVIEW
+        # ---------------------------------------------------------------------
+        st.markdown(f"# 👤 {customer['name']} ({customer['customer_code']})")
 
-    # -------------------------------------------------------------------------
-    # ADD NEW LOAN
-    # -------------------------------------------------------------------------
-    if not active_loan_exists:
-        st.markdown("<div class='big-btn'>", unsafe_allow_html=True)
-        if st.button("➕ ADD NEW LOAN", use_container_width=True):
-            go("add_loan")
-            st.rerun()
+        st.markdown("<div class='card'>", unsafe_allow_html=True)
+        c1, c2, c3 = st.columns(3)
+        c1.write(f"📞 **Mobile 1:** {customer['mobile1']}")
+        c2.write(f"📞 **Mobile 2:** {customer.get('second_mobile','-') or '-'}")
+        c3.write(f"🪪 **Aadhar:** {customer.get('aadhar_number','-') or '-'}")
+
+        c4, c5 = st.columns(2)
+        c4.write(f"👥 **Referral:** {customer.get('referral_name','-') or '-'}")
+        c5.write(f"🏠 **Address:** {customer['address']}")
         st.markdown("</div>", unsafe_allow_html=True)
 
-    # -------------------------------------------------------------------------
-    # DELETE CUSTOMER (PASSWORD PROTECTED)
-    # -------------------------------------------------------------------------
-    st.divider()
-    with st.expander("🗑 DELETE CUSTOMER (DANGER ZONE)"):
-        st.warning("This will permanently delete the customer and ALL loan data")
-
-        del_pwd = st.text_input("Delete Password", type="password")
-        confirm = st.checkbox("I understand this cannot be undone")
-
-        if st.button("DELETE CUSTOMER PERMANENTLY"):
-            if del_pwd != "Grnivas24@":
-                st.error("Incorrect password")
-            elif not confirm:
-                st.error("Please confirm deletion")
-            else:
-                cur = con.cursor()
-                cur.execute("""
-                    DELETE FROM daily_collections
-                    WHERE loan_id IN (SELECT id FROM loans WHERE customer_id=%s)
-                """, (cid,))
-                cur.execute("DELETE FROM loans WHERE customer_id=%s", (cid,))
-                cur.execute("DELETE FROM customers WHERE id=%s", (cid,))
-                con.commit()
-
-                st.success("Customer deleted permanently")
-                go("dashboard")
-                st.rerun()
-
-    con.close()
-
-
+        # ---------------------------------------------------------------------
+        # EDIT CUSTOMER DETAILS
+        # ---------------------------------------------------------------------
+        with st.expander("✏️ Edit Customer Details"):
+            with st.form("edit_customer"):
+                name = st.text_input("Name", value=customer["name"])
+                aadhar = st.text_input("Aadhar", value=customer.get("aadhar_number",""))
+                mobile1 = st.text_input("Mobile 1", value=customer["mobile1"])
+                mobile2 = st.text_input("Mobile 2", value=customer.get("second_mobile",""))
+                referral = st.text_input("Referral", value=customer.get("referral_name",""))
+                address = st.text_area("Address", value=customer["address"])
+
+                if st.form_submit_button("SAVE CUSTOMER"):
+                    cur = con.cursor()
+                    cur.execute("""
+                        UPDATE customers
+                        SET name=%s, aadhar_number=%s,
+                            mobile1=%s, second_mobile=%s,
+                            referral_name=%s, address=%s
+                        WHERE id=%s
+                    """, (name, aadhar, mobile1, mobile2, referral, address, cid))
+                    notify(cur, "customers")
+                    con.commit()
+                    invalidate("customers", con=con)
+                    st.success("Customer updated successfully")
+                    st.rerun()
+
+        # ---------------------------------------------------------------------
+        # LOANS SECTION
+        # ---------------------------------------------------------------------
+        st.markdown("## 💰 Loan History")
+
+        active_loan_exists = False
+
+        for _, loan in loans.iterrows():
+
+            hist = schedules.get(loan["id"], no_schedule)
+
+            paid = loan["paid_total"]
+            remaining = loan["total_amount"] - paid
+            collection_started = paid > 0
+
+            if loan["status"] == "Active":
+                active_loan_exists = True
 
-# =============================================================================
-# ADD NEW LOAN (EXISTING CUSTOMER)
-# =============================================================================
-elif st.session_state.page == "add_loan":
-
-    st.button("⬅ Back", on_click=lambda: go("customer_dashboard"))
+            st.markdown("<div class='card'>", unsafe_allow_html=True)
+            st.subheader(f"Loan ID: {loan['id']}")
+
+            # ---------------- KPIs ----------------
+            k1, k2, k3, k4, k5 = st.columns(5)
+            k1.metric("Total", f"₹{loan['total_amount']}")
+            k2.metric("Paid", f"₹{paid}")
+            k3.metric("Remaining", f"₹{remaining}")
+            k4.metric("Status", loan["status"])
+            k5.metric(
+                "Collection",
+                "Started" if collection_started else "Not Started"
+            )
+
+            st.write(
+                f"📅 {loan['start_date']} → {loan['end_date']} | "
+                f"💵 Daily ₹{loan['daily_amount']} | "
+                f"🗓 {loan['duration_days']} days"
+            )
+
+            # ---------------- DAILY COLLECTION TABLE ----------------
+            st.dataframe(
+                hist.style.applymap(
+                    lambda x: "background-color:#dcfce7" if x == "Paid" else "",
+                    subset=["status"]
+                ),
+                use_container_width=True,
+                height=260
+            )
+
+            st.download_button(
+                "📄 Download Loan Statement",
+                statement_data(customer, loan, hist),
+                f"{customer['name']}_loan_{loan['id']}.pdf",
+                mime="application/pdf",
+                key=f"pdf_{loan['id']}"
+            )
+
+            # ---------------- EDIT LOAN ----------------
+            if loan["status"] == "Active" and not collection_started:
+                with st.expander("✏️ Edit Loan (Before Collection Starts)"):
+                    with st.form(f"edit_loan_{loan['id']}"):
+                        total = st.number_input("Total Amount", value=loan["total_amount"])
+                        interest = st.number_input("Interest", value=loan["interest"])
+                        actual = st.number_input("Actual Given", value=loan["actual_given"])
+                        daily = st.number_input("Daily Amount", value=loan["daily_amount"])
+                        days = st.number_input("Duration (Days)", value=loan["duration_days"])
+                        loan_date = st.date_input("Loan Date", value=loan["loan_date"])
+
+                        if st.form_submit_button("UPDATE LOAN"):
+                            cur = con.cursor()
+                            update_loan(
+                                cur, loan["id"], total, interest, actual, daily, days, loan_date,
+                                user=st.session_state.get("username")
+                            )
+                            con.commit()
+                            invalidate("loans", "collections", f"loan:{loan['id']}", con=con)
+                            st.success("Loan updated")
+                            st.rerun()
+
+            # ---------------- CLOSE LOAN ----------------
+            if loan["status"] == "Active":
+                with st.expander("🔒 Close Loan"):
+                    with st.form(f"close_{loan['id']}"):
+                        close_amt = st.number_input("Remaining Amount Collected", value=remaining)
+                        close_date = st.date_input("Close Date", value=date.today())
+
+                        if st.form_submit_button("CLOSE LOAN"):
+                            cur = con.cursor()
+                            close_loan(cur, loan["id"], close_amt, close_date, user=st.session_state.get("username"))
+                            con.commit()
+                            invalidate("loans", "collections", f"loan:{loan['id']}", con=con)
+                            st.success("Loan closed successfully")
+                            st.rerun()
 
-    cid = st.session_state.customer_id
-    st.markdown("## ➕ Add New Loan (Existing Customer)")
+            st.markdown("</div>", unsafe_allow_html=True)
 
-    con = get_conn()
+        # ---------------------------------------------------------------------
+        # ADD NEW LOAN
+        # ---------------------------------------------------------------------
+        if not active_loan_exists:
+            st.markdown("<div class='big-btn'>", unsafe_allow_html=True)
+            if st.button("➕ ADD NEW LOAN", use_container_width=True):
+                go("add_loan")
+                st.rerun()
+            st.markdown("</div>", unsafe_allow_html=True)
 
-    active = pd.read_sql("""
-        SELECT COUNT(*) cnt
-        FROM loans
-        WHERE customer_id=%s AND status='Active'
-    """, con, params=(cid,)).iloc[0]["cnt"]
+        # ---------------------------------------------------------------------
+        # DELETE CUSTOMER (PASSWORD PROTECTED)
+        # ---------------------------------------------------------------------
+        st.divider()
+        with st.expander("🗑 DELETE CUSTOMER (DANGER ZONE)"):
+            st.warning("This will permanently delete the customer and ALL loan data")
+
+            del_pwd = st.text_input("Delete Password", type="password")
+            confirm = st.checkbox("I understand this cannot be undone")
+
+            if st.button("DELETE CUSTOMER PERMANENTLY"):
+                if del_pwd != "Grnivas24@":
+                    st.error("Incorrect password")
+                elif not confirm:
+                    st.error("Please confirm deletion")
+                else:
+                    cur = con.cursor()
+                    delete_customer(cur, cid, user=st.session_state.get("username"))
+                    con.commit()
+                    invalidate("customers", "loans", "collections", *(f"loan:{i}" for i in loans["id"]), con=con)
+
+                    st.success("Customer deleted permanently")
+                    go("dashboard")
+                    st.rerun()
 
-    if active > 0:
-        st.error("❌ This customer already has an active loan. Close it first.")
         con.close()
-        st.stop()
-
-    with st.form("add_new_loan_form"):
-        l1, l2, l3 = st.columns(3)
-        total_amount = l1.number_input("Total Loan Amount", min_value=0)
-        interest = l2.number_input("Interest", min_value=0)
-        actual_given = l3.number_input("Actual Given", value=max(total_amount - interest, 0))
-
-        d1, d2, d3 = st.columns(3)
-        daily_amount = d1.number_input("Daily Amount", min_value=1)
-        duration_days = d2.number_input("Duration (Days)", min_value=1)
-        loan_date = d3.date_input("Loan Date", value=date.today())
-
-        submit = st.form_submit_button("CREATE LOAN")
-
-    if submit:
-        start_date = loan_date + timedelta(days=1)
-        end_date = start_date + timedelta(days=duration_days - 1)
-
-        cur = con.cursor()
-        cur.execute("""
-            INSERT INTO loans
-            (customer_id, total_amount, interest, actual_given,
-             daily_amount, duration_days,
-             loan_date, start_date, end_date, status)
-            VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,'Active')
-            RETURNING id
-        """, (
-            cid,
-            total_amount, interest, actual_given,
-            daily_amount, duration_days,
-            loan_date, start_date, end_date
-        ))
-
-        loan_id = cur.fetchone()[0]
-
-        for i in range(duration_days):
-            cur.execute("""
-                INSERT INTO daily_collections
-                (loan_id, collection_date, amount_due, amount_paid, status)
-                VALUES (%s,%s,%s,0,'Pending')
-            """, (
-                loan_id,
-                start_date + timedelta(days=i),
-                daily_amount
-            ))
 
-        con.commit()
-        con.close()
 
-        st.success("New loan created successfully")
-        go("customer_dashboard")
-        st.rerun()
 
-# =============================================================================
-# DAILY COLLECTION (PLACEHOLDER – CONNECTED)
-# =============================================================================
-# =============================================================================
-# DAILY COLLECTION
-# =============================================================================
-elif st.session_state.page == "collection":
-
-    st.button("⬅ Back", on_click=lambda: go("dashboard"))
-    st.markdown("## 💰 Daily Collection")
-
-    sel_date = st.date_input("📅 Select Date", value=date.today())
-
-    con = get_conn()
-
-    df = pd.read_sql("""
-        SELECT
-            dc.id,
-            c.customer_code,
-            c.name,
-            dc.amount_due,
-            dc.amount_paid,
-            dc.status
-        FROM daily_collections dc
-        JOIN loans l ON dc.loan_id = l.id
-        JOIN customers c ON l.customer_id = c.id
-        WHERE dc.collection_date = %s
-          AND l.status = 'Active'
-        ORDER BY c.name
-    """, con, params=(sel_date,))
-
-    if df.empty:
-        st.info("No collections for this date")
-        con.close()
-        st.stop()
+    # =========================================================================
+    # ADD NEW LOAN (EXISTING CUSTOMER)
+    # =========================================================================
+    elif st.session_state.page == "add_loan":
 
-    # ---------------- KPIs ----------------
-    expected = int(df["amount_due"].sum())
-    collected = int(df["amount_paid"].sum())
-    pending = expected - collected
+        st.button("⬅ Back", on_click=lambda: go("customer_dashboard"))
 
-    k1, k2, k3 = st.columns(3)
-    k1.metric("Expected", f"₹{expected}")
-    k2.metric("Collected", f"₹{collected}")
-    k3.metric("Pending", f"₹{pending}")
+        cid = st.session_state.customer_id
+        st.markdown("## ➕ Add New Loan (Existing Customer)")
 
-    st.divider()
+        con = get_conn()
 
-    # ---------------- COLLECTION LIST ----------------
-    for _, r in df.iterrows():
+        active = pd.read_sql("""
+            SELECT COUNT(*) cnt
+            FROM loans
+            WHERE customer_id=%s AND status='Active'
+        """, con, params=(cid,)).iloc[0]["cnt"]
 
-        paid = r["amount_paid"] > 0
-        bg = "#dcfce7" if paid else "#fee2e2"
+        if active > 0:
+            st.error("❌ This customer already has an active loan. Close it first.")
+            con.close()
+            stop()
 
-        st.markdown(
-            f"<div class='card' style='background:{bg}'>",
-            unsafe_allow_html=True
-        )
+        with st.form("add_new_loan_form"):
+            l1, l2, l3 = st.columns(3)
+            total_amount = l1.number_input("Total Loan Amount", min_value=0)
+            interest = l2.number_input("Interest", min_value=0)
+            actual_given = l3.number_input("Actual Given", value=max(total_amount - interest, 0))
 
-        a, b, c, d, e = st.columns([2, 3, 2, 2, 1])
+            d1, d2, d3 = st.columns(3)
+            daily_amount = d1.number_input("Daily Amount", min_value=1)
+            duration_days = d2.number_input("Duration (Days)", min_value=1)
+            loan_date = d3.date_input("Loan Date", value=date.today())
 
-        a.write(f"**{r['customer_code']}**")
-        b.write(f"**{r['name']}**")
-        c.write(f"Due ₹{r['amount_due']}")
+            submit = st.form_submit_button("CREATE LOAN")
 
-        amt = d.number_input(
-            "Paid",
-            min_value=0,
-            value=int(r["amount_paid"]),
-            key=f"amt_{r['id']}",
-            label_visibility="collapsed"
-        )
-
-        if e.button("✔", key=f"save_{r['id']}"):
+        if submit:
             cur = con.cursor()
-            cur.execute("""
-                UPDATE daily_collections
-                SET amount_paid=%s,
-                    status=%s
-                WHERE id=%s
-            """, (
-                amt,
-                "Paid" if amt > 0 else "Pending",
-                r["id"]
-            ))
+            create_loan(
+                cur, cid,
+                total_amount, daily_amount, duration_days, loan_date,
+                interest=interest, actual_given=actual_given
+            )
+
             con.commit()
+            invalidate("loans", "collections", con=con)
+            con.close()
+
+            st.success("New loan created successfully")
+            go("customer_dashboard")
             st.rerun()
 
-        st.markdown("</div>", unsafe_allow_html=True)
+    # =========================================================================
+    # DAILY COLLECTION (PLACEHOLDER – CONNECTED)
+    # =========================================================================
+    # =========================================================================
+    # DAILY COLLECTION
+    # =========================================================================
+    elif st.session_state.page == "collection":
 
-    con.close()
+        st.button("⬅ Back", on_click=lambda: go("dashboard"))
+        st.markdown("## 💰 Daily Collection")
 
-# =============================================================================
-# REPORTS (PLACEHOLDER – CONNECTED)
-# =============================================================================
-# =============================================================================
-# REPORTS
-# =============================================================================
-elif st.session_state.page == "reports":
+        d1, d2 = st.columns([4, 1])
+        sel_date = d1.date_input("📅 Select Date", value=date.today())
+        refresh = d2.button("🔄 Refresh", use_container_width=True)
 
-    st.button("⬅ Back", on_click=lambda: go("dashboard"))
-    st.markdown("## 📊 Reports")
+        df = collection_rows(sel_date, refresh)
 
-    # -------------------------------------------------------------------------
-    # FILTERS
-    # -------------------------------------------------------------------------
-    mode = st.radio("Select Report Type", ["Single Date", "Date Range"], horizontal=True)
+        if df.empty:
+            st.info("No collections for this date")
+            stop()
 
-    if mode == "Single Date":
-        from_date = st.date_input("Select Date", value=date.today())
-        to_date = from_date
-    else:
-        c1, c2 = st.columns(2)
-        from_date = c1.date_input("From Date", value=date.today() - timedelta(days=7))
-        to_date = c2.date_input("To Date", value=date.today())
+        # ---------------- KPIs ----------------
+        # a full rerun draws the strip here; only a row's own fragment rerun
+        # has to redraw it after a save
+        st.session_state.pop("collection_saved", None)
+        kpi_box = st.empty()
+        collection_kpis(kpi_box, df)
+
+        st.divider()
+
+        mode = st.radio("Entry Mode", ["Row by Row", "Batch Grid"], horizontal=True)
+
+        # ---------------- BATCH GRID ----------------
+        if mode == "Batch Grid":
+            edited = st.data_editor(
+                df,
+                key=f"grid_{sel_date}",
+                hide_index=True,
+                use_container_width=True,
+                disabled=["loan_id", "collection_date", "customer_code", "name", "amount_due", "status"],
+                column_config={
+                    "loan_id": None,
+                    "collection_date": None,
+                    "amount_paid": st.column_config.NumberColumn("Paid", min_value=0, step=1, required=True),
+                },
+            )
+
+            # a cleared cell comes back as NaN; leave those rows out rather than guess
+            blank = edited["amount_paid"].isna()
+            if blank.any():
+                st.warning(f"{int(blank.sum())} row(s) left blank are not saved – enter 0 for nothing collected")
+            changed = edited[~blank & (edited["amount_paid"] != df["amount_paid"])]
+
+            if changed.empty:
+                st.caption("Enter the amounts collected, then save them all at once.")
+            else:
+                summary = changed[["customer_code", "name"]].copy()
+                summary["old"] = df.loc[changed.index, "amount_paid"]
+                summary["new"] = changed["amount_paid"].astype(int)
+                diff = int((summary["new"] - summary["old"]).sum())
+
+                st.markdown(f"### 📝 {len(summary)} change(s) | Net ₹{diff:+}")
+                st.dataframe(summary, hide_index=True, use_container_width=True)
+
+                if st.button(f"💾 SAVE {len(summary)} CHANGES", use_container_width=True):
+                    con = get_conn(); cur = con.cursor()
+                    loan_ids = save_payments(
+                        cur, zip(changed["loan_id"], changed["collection_date"], changed["amount_paid"]),
+                        user=st.session_state.get("username")
+                    )
+                    con.commit()
+                    invalidate("collections", *(f"loan:{i}" for i in loan_ids), con=con)
+                    con.close()
+                    set_paid(df, changed.index, summary["new"])
+                    del st.session_state[f"grid_{sel_date}"]
+                    st.success(f"Saved {len(summary)} payments")
+                    st.rerun()
+
+            stop()
+
+        # ---------------- COLLECTION LIST ----------------
+        for i in df.index:
+            collection_row(sel_date, i, kpi_box)
+
+    # =========================================================================
+    # REPORTS (PLACEHOLDER – CONNECTED)
+    # =========================================================================
+    # =========================================================================
+    # REPORTS
+    # =========================================================================
+    elif st.session_state.page == "reports":
+
+        st.button("⬅ Back", on_click=lambda: go("dashboard"))
+        st.markdown("## 📊 Reports")
+
+        # ---------------------------------------------------------------------
+        # BULK STATEMENTS
+        # ---------------------------------------------------------------------
+        with st.expander("📦 Statements for all active loans"):
+            if st.button("Export Statements (ZIP)"):
+                bar = st.progress(0.0, "Starting…")
+                st.session_state.pop("statements_ready", None)
+                zip_path = download_path("statements", "zip")
+
+                con = get_read_conn()
+                n = export_statements(
+                    con, zip_path,
+                    # loans opened while exporting can push done past the count
+                    progress=lambda done, total: bar.progress(min(done / total, 1.0), f"{done}/{total} statements")
+                )
+                con.close()
+
+                st.session_state.statements_ready = True
+                bar.progress(1.0, f"{n} statements ready")
+
+            zip_path = st.session_state.get("download_statements")
+            if st.session_state.get("statements_ready") and os.path.exists(zip_path):
+                st.download_button(
+                    "⬇ Download ZIP",
+                    lambda: read_file(zip_path),
+                    f"statements_{date.today()}.zip",
+                    mime="application/zip"
+                )
+
+        # ---------------------------------------------------------------------
+        # FILTERS
+        # ---------------------------------------------------------------------
+        mode = st.radio("Select Report Type", ["Single Date", "Date Range"], horizontal=True)
+
+        if mode == "Single Date":
+            from_date = st.date_input("Select Date", value=date.today())
+            to_date = from_date
+        else:
+            c1, c2 = st.columns(2)
+            from_date = c1.date_input("From Date", value=date.today() - timedelta(days=7))
+            to_date = c2.date_input("To Date", value=date.today())
+
+        # ---------------------------------------------------------------------
+        # EXPORT (streamed to a temp file, never loaded into a DataFrame)
+        # ---------------------------------------------------------------------
+        with st.expander("⬇ Export"):
+            labels = {"collections": "Collection rows", "customers": "Customer-wise", "dates": "Date-wise"}
+            e1, e2 = st.columns(2)
+            kind = e1.selectbox("Data", list(EXPORTS), format_func=labels.get)
+            fmt = e2.radio("Format", list(WRITERS), format_func=str.upper, horizontal=True)
+
+            if st.button("Prepare Export"):
+                st.session_state.pop("report_export", None)
+                path = download_path("export", fmt)
+                con = get_read_conn()
+                with st.spinner("Exporting…"):
+                    n = WRITERS[fmt](con, kind, from_date, to_date, path)
+                con.close()
+                st.session_state.report_export = (path, f"{kind}_{from_date}_{to_date}.{fmt}", n)
+
+            export = st.session_state.get("report_export")
+            if export and os.path.exists(export[0]):
+                path, name, n = export
+                st.download_button(
+                    f"⬇ Download {name} ({n} rows)",
+                    lambda: read_file(path),
+                    name,
+                    mime="text/csv" if name.endswith(".csv") else
+                    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                )
+
+        totals, cust_summary, date_summary = cached_read(
+            report_summary, from_date, to_date, tags=("customers", "collections", "summaries"), replica=True
+        )
 
-    con = get_conn()
-
-    # -------------------------------------------------------------------------
-    # BASE DATA
-    # -------------------------------------------------------------------------
-    df = pd.read_sql("""
-        SELECT
-            dc.collection_date,
-            c.customer_code,
-            c.name,
-            dc.amount_due,
-            dc.amount_paid,
-            dc.status
-        FROM daily_collections dc
-        JOIN loans l ON dc.loan_id = l.id
-        JOIN customers c ON l.customer_id = c.id
-        WHERE dc.collection_date BETWEEN %s AND %s
-    """, con, params=(from_date, to_date))
-
-    if df.empty:
-        st.warning("No data found for selected period")
-        con.close()
-        st.stop()
-
-    # -------------------------------------------------------------------------
-    # KPIs
-    # -------------------------------------------------------------------------
-    total_due = int(df["amount_due"].sum())
-    total_paid = int(df["amount_paid"].sum())
-    total_pending = total_due - total_paid
-    customers_paid = df[df["amount_paid"] > 0]["customer_code"].nunique()
-
-    k1, k2, k3, k4 = st.columns(4)
-    k1.metric("Total Due", f"₹{total_due}")
-    k2.metric("Total Collected", f"₹{total_paid}")
-    k3.metric("Total Pending", f"₹{total_pending}")
-    k4.metric("Customers Paid", customers_paid)
-
-    st.divider()
-
-    # -------------------------------------------------------------------------
-    # CUSTOMER-WISE SUMMARY
-    # -------------------------------------------------------------------------
-    st.markdown("### 👥 Customer-wise Collection")
-
-    cust_summary = (
-        df.groupby(["customer_code", "name"], as_index=False)
-        .agg({
-            "amount_due": "sum",
-            "amount_paid": "sum"
-        })
-    )
-    cust_summary["pending"] = cust_summary["amount_due"] - cust_summary["amount_paid"]
+        if totals is None:
+            st.warning("No data found for selected period")
+            stop()
+
+        # ---------------------------------------------------------------------
+        # KPIs
+        # ---------------------------------------------------------------------
+        k1, k2, k3, k4 = st.columns(4)
+        k1.metric("Total Due", f"₹{int(totals['amount_due'])}")
+        k2.metric("Total Collected", f"₹{int(totals['amount_paid'])}")
+        k3.metric("Total Pending", f"₹{int(totals['pending'])}")
+        k4.metric("Customers Paid", int(totals["customers_paid"]))
+        if not totals["summarized"]:
+            st.caption("Live figures")
+        elif pd.notna(totals["as_of"]):
+            st.caption(
+                f"Whole months as of {totals['as_of']:%d-%m-%Y %H:%M} (summaries are refreshed "
+                f"every few minutes), the days outside them live"
+            )
+
+        st.divider()
+
+        # ---------------------------------------------------------------------
+        # CUSTOMER-WISE SUMMARY
+        # ---------------------------------------------------------------------
+        st.markdown("### 👥 Customer-wise Collection")
+        st.dataframe(cust_summary, use_container_width=True)
+
+        # ---------------------------------------------------------------------
+        # DATE-WISE SUMMARY
+        # ---------------------------------------------------------------------
+        st.markdown("### 📅 Date-wise Collection")
+        st.dataframe(date_summary, use_container_width=True)
+
+        # ---------------------------------------------------------------------
+        # PENDING CUSTOMERS (detail rows, only when asked for)
+        # ---------------------------------------------------------------------
+        st.markdown("### ⏳ Pending Customers")
+
+        if st.toggle("Show pending list"):
+            con = get_read_conn()
+            pending_df = report_pending(con, from_date, to_date)
+            con.close()
+
+            if pending_df.empty:
+                st.success("No pending customers 🎉")
+            else:
+                st.dataframe(pending_df, use_container_width=True)
+
+    # =========================================================================
+    # OVERDUE LOANS
+    # =========================================================================
+    elif st.session_state.page == "overdue":
+
+        st.button("⬅ Back", on_click=lambda: go("dashboard"))
+        st.markdown("## 🚨 Overdue Loans")
+
+        # recomputed once per day (the entry lives until midnight), or sooner
+        # when a payment or loan changes
+        today = date.today()
+        until_midnight = (datetime.combine(today + timedelta(days=1), datetime.min.time()) - datetime.now()).total_seconds()
+        df = cached_read(overdue_loans, today, tags=("loans", "collections"), ttl=until_midnight, replica=True)
+
+        if df.empty:
+            st.success("No active loan is behind 🎉")
+            stop()
+
+        k1, k2, k3, k4 = st.columns(4)
+        k1.metric("Loans Behind", len(df))
+        k2.metric("Total Arrears", f"₹{int(df['arrears'].sum())}")
+        k3.metric("Over 30 Days", int((df["days_overdue"] > 30).sum()))
+        k4.metric("Past End Date", int(df["past_end"].sum()))
+
+        counts = df["bucket"].value_counts()
+        buckets = st.multiselect(
+            "Days overdue", OVERDUE_BUCKETS, default=OVERDUE_BUCKETS,
+            format_func=lambda b: f"{b} ({counts.get(b, 0)})"
+        )
+        view = df[df["bucket"].isin(buckets)]
 
-    st.dataframe(cust_summary, use_container_width=True)
+        st.dataframe(
+            view.drop(columns=["bucket"]),
+            use_container_width=True, hide_index=True,
+            column_config={
+                "loan_id": st.column_config.NumberColumn("Loan", format="%d"),
+                "arrears": st.column_config.NumberColumn("Arrears ₹"),
+                "days_overdue": st.column_config.NumberColumn("Days Overdue"),
+                "missed_streak": st.column_config.NumberColumn("Missed In A Row"),
+                "past_end": st.column_config.CheckboxColumn("Past End"),
+            }
+        )
 
-    # -------------------------------------------------------------------------
-    # DATE-WISE SUMMARY
-    # -------------------------------------------------------------------------
-    st.markdown("### 📅 Date-wise Collection")
+    # =========================================================================
+    # BULK IMPORT
+    # =========================================================================
+    elif st.session_state.page == "import":
 
-    date_summary = (
-        df.groupby("collection_date", as_index=False)
-        .agg({
-            "amount_due": "sum",
-            "amount_paid": "sum"
-        })
-    )
-    date_summary["pending"] = date_summary["amount_due"] - date_summary["amount_paid"]
+        st.button("⬅ Back", on_click=lambda: go("dashboard"))
+        st.markdown("## 📥 Bulk Import")
+        st.caption(
+            "One row per customer. Leave the loan columns empty for a customer without a loan. "
+            "Dates as YYYY-MM-DD or DD/MM/YYYY."
+        )
+        st.download_button("⬇ CSV Template", imports.TEMPLATE, "import_template.csv", mime="text/csv")
+
+        upload = st.file_uploader("Customers CSV", type=["csv"])
+        if upload is None:
+            stop()
+
+        con = get_conn()
+        rows, errors = imports.validate(imports.read_csv(upload), con)
+
+        if not errors.empty:
+            con.close()
+            st.error(f"{len(errors)} problems found – fix them and upload again. Nothing was imported.")
+            st.dataframe(errors, use_container_width=True, hide_index=True)
+            stop()
+
+        n_loans = int(rows[imports.LOAN_REQUIRED].notna().all(axis=1).sum())
+        st.success(f"{len(rows)} customers and {n_loans} loans are ready to import")
+        st.dataframe(rows.head(20), use_container_width=True)
+
+        if st.button("IMPORT", type="primary"):
+            with st.spinner("Importing…"):
+                customers, loans = imports.load(con, rows, user=st.session_state.get("username"))
+            invalidate("customers", "loans", "collections", con=con)
+            con.close()
+            st.success(f"Imported {customers} customers and {loans} loans")
+        else:
+            con.close()
 
-    st.dataframe(date_summary, use_container_width=True)
+    # =========================================================================
+    # AUDIT LOG
+    # =========================================================================
+    elif st.session_state.page == "audit":
 
-    # -------------------------------------------------------------------------
-    # PENDING CUSTOMERS
-    # -------------------------------------------------------------------------
-    st.markdown("### ⏳ Pending Customers")
+        st.button("⬅ Back", on_click=lambda: go("dashboard"))
+        st.markdown("## 🧾 Audit Log")
 
-    pending_df = df[df["amount_paid"] == 0][
-        ["collection_date", "customer_code", "name", "amount_due"]
-    ]
+        c1, c2, c3, c4 = st.columns(4)
+        from_date = c1.date_input("From Date", value=date.today() - timedelta(days=7))
+        to_date = c2.date_input("To Date", value=date.today())
+        loan_id = c3.number_input("Loan ID (0 = all)", min_value=0, step=1)
+        action = c4.selectbox("Action", ["All", "payment", "loan_edit", "loan_close", "customer_delete", "customer_import"])
 
-    if pending_df.empty:
-        st.success("No pending customers 🎉")
-    else:
-        st.dataframe(pending_df, use_container_width=True)
+        con = get_read_conn()
+        df = audit_log(con, from_date, to_date, loan_id or None, None if action == "All" else action)
+        con.close()
 
-    con.close()
+        if df.empty:
+            st.info("No changes recorded for these filters")
+        else:
+            st.caption(f"Latest {len(df)} entries")
+            st.dataframe(df, use_container_width=True, hide_index=True)
+
+# =============================================================================
+# QUERY TIMINGS
+# =============================================================================
+finally:
+    finish_run()
@@ -0,0 +1,313 @@
+# =============================================================================
+# SYNTHETIC-DATA BENCHMARK OF THE APP'S QUERY PATHS
+# =============================================================================
+# Seeds a throwaway Postgres with a synthetic loan book and times the queries
+# every page runs, using the same functions the app calls (queries.py /
+# loans.py), so an index or query change shows up as a p50/p95 difference.
+#
+#   BENCH_DATABASE_URL=postgresql://... python bench.py --seed --customers 10000
+#   BENCH_DATABASE_URL=postgresql://... python bench.py --json before.json
+#   BENCH_DATABASE_URL=postgresql://... python bench.py --compare before.json
+#
+# --seed wipes customers, loans, schedules, payments and audit_logs, which is
+# why the script only ever connects to BENCH_DATABASE_URL.
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import warnings
+from datetime import date, timedelta
+
+FIRST_NAMES = [
+    "Arun", "Bala", "Chitra", "Divya", "Ganesh", "Hari", "Indira", "Jaya",
+    "Karthik", "Lakshmi", "Mani", "Nithya", "Prakash", "Priya", "Ravi",
+    "Saravanan", "Selvi", "Suresh", "Vani", "Vijay",
+]
+LAST_NAMES = [
+    "Kumar", "Raj", "Devi", "Murugan", "Pandian", "Shankar", "Krishnan",
+    "Subramani", "Natarajan", "Velu",
+]
+DURATIONS = [50, 100, 100, 100, 120, 150, 200]
+DAILY_AMOUNTS = [100, 200, 250, 500, 1000]
+
+
+# -----------------------------------------------------------------------------
+# SEEDING
+# -----------------------------------------------------------------------------
+def seed(con, customers, loans_per_customer, history_days, pay_rate, mode, rng_seed):
+    """Replace the book with a synthetic one, entirely in SQL.
+
+    Loans start at random points over the last `history_days`, with the
+    usual durations and daily amounts; loans whose schedule is over are
+    Closed and fully paid, the rest have each past day paid with
+    probability `pay_rate` (some only partly). Balances are then derived
+    with loans.refresh_balances, as for real data.
+    """
+    from loans import refresh_balances
+    from summaries import refresh
+
+    cur = con.cursor()
+    cur.execute("SELECT setseed(%s)", (rng_seed,))
+    cur.execute(
+        "TRUNCATE audit_logs, payments, payments_archive, daily_collections, "
+        "daily_collections_archive, loans, customers RESTART IDENTITY"
+    )
+
+    cur.execute("""
+        INSERT INTO customers (customer_code, name, mobile1, second_mobile, address, created_at)
+        SELECT
+            'C' || lpad(i::text, 7, '0'),
+            (%(first)s::text[])[1 + floor(random() * cardinality(%(first)s::text[]))::int]
+              || ' ' || (%(last)s::text[])[1 + floor(random() * cardinality(%(last)s::text[]))::int],
+            (6000000000 + floor(random() * 3999999999))::bigint::text,
+            CASE WHEN random() < 0.3 THEN (6000000000 + floor(random() * 3999999999))::bigint::text END,
+            'Street ' || i,
+            CURRENT_TIMESTAMP - random() * make_interval(days => %(history)s)
+        FROM generate_series(1, %(n)s) i
+    """, {"first": FIRST_NAMES, "last": LAST_NAMES, "history": history_days, "n": customers})
+
+    cur.execute("""
+        WITH c AS (
+            SELECT id, GREATEST(1, round(random() * 2 * %(per)s)::int) AS n FROM customers
+        ),
+        t AS (
+            SELECT
+                c.id AS customer_id,
+                (%(durations)s::int[])[1 + floor(random() * cardinality(%(durations)s::int[]))::int] AS days,
+                (%(daily)s::int[])[1 + floor(random() * cardinality(%(daily)s::int[]))::int] AS daily,
+                CURRENT_DATE - floor(random() * %(history)s)::int AS loan_date
+            FROM c, generate_series(1, c.n)
+        )
+        INSERT INTO loans
+        (customer_id, total_amount, interest, actual_given,
+         daily_amount, duration_days,
+         loan_date, start_date, end_date, status, schedule_mode)
+        SELECT customer_id, daily * days, daily * days / 10, daily * days * 9 / 10,
+               daily, days,
+               loan_date, loan_date + 1, loan_date + days,
+               CASE WHEN loan_date + days < CURRENT_DATE THEN 'Closed' ELSE 'Active' END,
+               %(mode)s
+        FROM t
+    """, {"per": loans_per_customer, "durations": DURATIONS, "daily": DAILY_AMOUNTS,
+          "history": history_days, "mode": mode})
+
+    # one row per scheduled day with what was paid on it
+    schedule = """
+        SELECT l.id AS loan_id, d::date AS collection_date, l.daily_amount AS amount_due, p.paid
+        FROM loans l
+        CROSS JOIN generate_series(l.start_date, l.end_date, interval '1 day') d
+        CROSS JOIN LATERAL (
+            SELECT CASE
+                WHEN d::date > CURRENT_DATE THEN 0
+                WHEN l.status = 'Closed' THEN l.daily_amount
+                WHEN random() < %(rate)s THEN
+                    CASE WHEN random() < 0.1 THEN l.daily_amount / 2 ELSE l.daily_amount END
+                ELSE 0
+            END AS paid
+        ) p
+    """
+    if mode == "ledger":
+        cur.execute(f"""
+            INSERT INTO payments (loan_id, collection_date, amount_paid)
+            SELECT loan_id, collection_date, paid FROM ({schedule}) s WHERE paid > 0
+        """, {"rate": pay_rate})
+    else:
+        cur.execute(f"""
+            INSERT INTO daily_collections (loan_id, collection_date, amount_due, amount_paid, status)
+            SELECT loan_id, collection_date, amount_due, paid,
+                   CASE WHEN paid > 0 THEN 'Paid' ELSE 'Pending' END
+            FROM ({schedule}) s
+        """, {"rate": pay_rate})
+
+    refresh_balances(cur)
+    con.commit()
+    refresh(cur, full=True)
+    con.commit()
+
+    con.autocommit = True
+    cur.execute("ANALYZE customers, loans, daily_collections, payments")
+    con.autocommit = False
+
+    cur.execute("""
+        SELECT (SELECT COUNT(*) FROM customers),
+               (SELECT COUNT(*) FROM loans),
+               (SELECT COUNT(*) FROM loans WHERE status = 'Active'),
+               (SELECT COUNT(*) FROM daily_collections),
+               (SELECT COUNT(*) FROM payments)
+    """)
+    counts = cur.fetchone()
+    cur.close()
+    return dict(zip(["customers", "loans", "active", "daily_collections", "payments"], counts))
+
+
+# -----------------------------------------------------------------------------
+# CASES
+# -----------------------------------------------------------------------------
+def build_cases(con, today, samples=200):
+    """(name, fn) pairs; fn(con, rng) runs one page's reads and returns the
+    number of rows they produced. Ids and search terms are drawn from the
+    seeded data so every run looks up something different."""
+    import pandas as pd
+
+    from loans import create_loan, save_payments
+    from summaries import refresh
+    from queries import (
+        collection_day, customer_schedules, customers_page, dashboard_kpis,
+        overdue_loans, report_summary, search_customers,
+    )
+
+    sample = pd.read_sql("""
+        SELECT id, name, mobile1, customer_code FROM customers ORDER BY random() LIMIT %s
+    """, con, params=(samples,))
+    if sample.empty:
+        sys.exit("❌ No customers – run with --seed first")
+    customer_ids = sample["id"].tolist()
+    names = sample["name"].str[:3].tolist()
+    mobiles = sample["mobile1"].str[:5].tolist()
+
+    first_page, _ = customers_page(con, 50)
+    deep = first_page.iloc[-1]
+    con.rollback()
+
+    def customer_dashboard(con, rng):
+        cid = rng.choice(customer_ids)
+        customer = pd.read_sql("SELECT * FROM customers WHERE id=%s", con, params=(cid,))
+        loans = pd.read_sql("SELECT * FROM loans WHERE customer_id=%s ORDER BY id DESC", con, params=(cid,))
+        schedules, _ = customer_schedules(con, cid)
+        return len(customer) + len(loans) + sum(len(s) for s in schedules.values())
+
+    def report(days):
+        return lambda con, rng: sum(
+            0 if part is None else len(part)
+            for part in report_summary(con, today - timedelta(days=days - 1), today)
+        )
+
+    def new_loan(con, rng):
+        cur = con.cursor()
+        create_loan(cur, rng.choice(customer_ids), 10000, 100, 100, today)
+        con.rollback()
+        return 100
+
+    def save_day(con, rng, then=None):
+        rows = collection_day(con, today)
+        picked = rows.sample(n=min(50, len(rows)), random_state=rng.randrange(1 << 30))
+        cur = con.cursor()
+        save_payments(cur, zip(picked["loan_id"], picked["collection_date"], picked["amount_due"]))
+        n = then(cur) if then else len(picked)
+        con.rollback()
+        return n
+
+    return [
+        ("dashboard kpis", lambda con, rng: len(dashboard_kpis(con, today))),
+        ("customer list p1", lambda con, rng: len(customers_page(con, 50)[0])),
+        ("customer list p2", lambda con, rng: len(customers_page(con, 50, (deep["created_at"], deep["id"]))[0])),
+        ("search name", lambda con, rng: len(search_customers(con, rng.choice(names)))),
+        ("search mobile", lambda con, rng: len(search_customers(con, rng.choice(mobiles)))),
+        ("customer dashboard", customer_dashboard),
+        ("collection day", lambda con, rng: len(collection_day(con, today))),
+        ("collection save 50", save_day),
+        ("save 50 + summaries", lambda con, rng: save_day(con, rng, then=refresh)),
+        ("report 1 day", report(1)),
+        ("report 7 days", report(7)),
+        ("report 90 days", report(90)),
+        ("overdue loans", lambda con, rng: len(overdue_loans(con, today))),
+        ("create loan", new_loan),
+    ]
+
+
+# -----------------------------------------------------------------------------
+# TIMING
+# -----------------------------------------------------------------------------
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def run(con, cases, repeat=20, warmup=2, only=None, rng_seed=0):
+    rng = random.Random(rng_seed)
+    results = {}
+    for name, fn in cases:
+        if only and not any(o in name for o in only):
+            continue
+        for _ in range(warmup):
+            fn(con, rng)
+            con.rollback()
+
+        timings, rows = [], 0
+        for _ in range(repeat):
+            started = time.perf_counter()
+            rows = fn(con, rng)
+            timings.append((time.perf_counter() - started) * 1000)
+            con.rollback()
+
+        results[name] = {
+            "runs": repeat,
+            "p50_ms": round(percentile(timings, 50), 2),
+            "p95_ms": round(percentile(timings, 95), 2),
+            "rows": int(rows),
+        }
+        print(f"  {name:<20} {results[name]['p50_ms']:>9.2f} {results[name]['p95_ms']:>9.2f} {rows:>8}", flush=True)
+    return results
+
+
+def compare(results, baseline):
+    print(f"\n  {'case':<20} {'p50 was':>9} {'p50 now':>9} {'change':>8}")
+    for name, r in results.items():
+        old = baseline.get(name)
+        if not old:
+            continue
+        change = (r["p50_ms"] - old["p50_ms"]) / old["p50_ms"] * 100 if old["p50_ms"] else 0.0
+        print(f"  {name:<20} {old['p50_ms']:>9.2f} {r['p50_ms']:>9.2f} {change:>+7.0f}%")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the app's queries on a synthetic book")
+    parser.add_argument("--seed", action="store_true", help="wipe and reseed the benchmark database")
+    parser.add_argument("--customers", type=int, default=10000)
+    parser.add_argument("--loans-per-customer", type=float, default=1.5)
+    parser.add_argument("--history-days", type=int, default=365)
+    parser.add_argument("--pay-rate", type=float, default=0.85)
+    parser.add_argument("--mode", choices=["materialized", "ledger"], default="materialized")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--only", action="append", help="run only cases containing this text (repeatable)")
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--compare", help="baseline results file from an earlier --json run")
+    parser.add_argument("--random-seed", type=float, default=0.42)
+    args = parser.parse_args()
+
+    # read_sql on a raw DBAPI connection warns on every call
+    warnings.filterwarnings("ignore", message="pandas only supports SQLAlchemy")
+
+    url = os.getenv("BENCH_DATABASE_URL")
+    if not url:
+        sys.exit("❌ Set BENCH_DATABASE_URL to a database that may be wiped")
+    # everything below (db_init, loans, queries) connects through db.py
+    os.environ["DATABASE_URL"] = url
+
+    from db import get_connection
+    from db_init import migrate
+
+    migrate()
+    conn = get_connection()
+
+    if args.seed:
+        started = time.monotonic()
+        counts = seed(conn, args.customers, args.loans_per_customer, args.history_days,
+                      args.pay_rate, args.mode, args.random_seed)
+        print(f"✅ Seeded in {time.monotonic() - started:.1f}s: "
+              + ", ".join(f"{v} {k}" for k, v in counts.items()))
+
+    cases = build_cases(conn, date.today())
+    print(f"\n  {'case':<20} {'p50 ms':>9} {'p95 ms':>9} {'rows':>8}")
+    results = run(conn, cases, repeat=args.repeat, only=args.only, rng_seed=args.random_seed)
+    conn.close()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
@@ -0,0 +1,180 @@
+# =============================================================================
+# IN-PROCESS TTL CACHE FOR READ QUERIES
+# =============================================================================
+# Entries carry tags naming what they were computed from ("customers",
+# "collections", ...). Write paths call invalidate() with the tags they
+# touched, so cached figures never outlive a write; the TTL only bounds how
+# stale data written outside this process can get.
+#
+# Across processes, writers call notify() inside their transaction; Postgres
+# delivers the NOTIFY to every listening process once it commits, and each
+# process's CacheListener evicts the same tags there. With the listener
+# running, CACHE_TTL is only a safety net and can be set generously.
+
+import json
+import os
+import select
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+CACHE_TTL = float(os.getenv("CACHE_TTL", "60"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "2048"))
+CACHE_CHANNEL = "cache_invalidate"
+# tags per NOTIFY, keeps each payload well under Postgres' 8000 byte limit
+NOTIFY_MAX_TAGS = 400
+
+
+class TTLCache:
+    def __init__(self, ttl=CACHE_TTL, maxsize=CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._data = OrderedDict()          # key -> (expires_at, value, tags)
+        self._by_tag = defaultdict(set)     # tag -> keys
+        self._generation = defaultdict(int) # tag -> bumped on every invalidate
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.listener = None
+
+    def _drop(self, key):
+        _, _, tags = self._data.pop(key)
+        for tag in tags:
+            self._by_tag[tag].discard(key)
+
+    def get_or_load(self, key, load, ttl=None, tags=()):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry and entry[0] > now:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            seen = {tag: self._generation[tag] for tag in tags}
+
+        value = load()
+
+        with self._lock:
+            # a write that landed while we were loading makes the value stale
+            if any(self._generation[tag] != gen for tag, gen in seen.items()):
+                return value
+            if key in self._data:
+                self._drop(key)
+            self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value, tuple(tags))
+            for tag in tags:
+                self._by_tag[tag].add(key)
+            while len(self._data) > self.maxsize:
+                self._drop(next(iter(self._data)))
+                self.evictions += 1
+        return value
+
+    def invalidate(self, *tags):
+        with self._lock:
+            for tag in tags:
+                self._generation[tag] += 1
+                for key in list(self._by_tag.pop(tag, ())):
+                    if key in self._data:
+                        self._drop(key)
+
+    def generation(self, tag):
+        """Counter bumped by every invalidation of `tag`, for callers that
+        hold their own copy of data and need to know when it went stale."""
+        with self._lock:
+            return self._generation[tag]
+
+    def clear(self):
+        with self._lock:
+            for tag in list(self._by_tag):
+                self._generation[tag] += 1
+            self._data.clear()
+            self._by_tag.clear()
+
+    def listen(self, dsn, **connect_kwargs):
+        """Follow invalidations sent by other processes (see notify())."""
+        if self.listener is None:
+            self.listener = CacheListener(self, dsn, **connect_kwargs)
+            self.listener.start()
+        return self.listener
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._data),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+# -----------------------------------------------------------------------------
+# CROSS-PROCESS INVALIDATION
+# -----------------------------------------------------------------------------
+def notify(cur, *tags):
+    """Queue an invalidation of `tags` for every app process; it is only
+    delivered if the caller's transaction commits."""
+    tags = list(dict.fromkeys(str(t) for t in tags))
+    for i in range(0, len(tags), NOTIFY_MAX_TAGS):
+        cur.execute("SELECT pg_notify(%s, %s)", (CACHE_CHANNEL, json.dumps(tags[i:i + NOTIFY_MAX_TAGS])))
+
+
+class CacheListener(threading.Thread):
+    """LISTENs on CACHE_CHANNEL over its own connection and evicts the tags
+    it is sent. Whatever was written while the connection was down is
+    unknown, so the whole cache is cleared on every (re)connect."""
+
+    POLL_SECONDS = 10
+
+    def __init__(self, cache, dsn, **connect_kwargs):
+        super().__init__(name="cache-listener", daemon=True)
+        self.cache = cache
+        self.dsn = dsn
+        self.connect_kwargs = connect_kwargs
+        self.connected = False
+        self.received = 0
+        self.reconnects = 0
+        # primary WAL position just after the last invalidation: data cached
+        # from a read replica is only current once it has replayed this far
+        self.lsn = 0
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        import psycopg2
+
+        backoff = 1
+        while not self._stop_event.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(self.dsn, **self.connect_kwargs)
+                conn.autocommit = True
+                cur = conn.cursor()
+                cur.execute(f"LISTEN {CACHE_CHANNEL}")
+                cur.execute("SELECT pg_current_wal_lsn() - '0/0'")
+                self.lsn = int(cur.fetchone()[0])
+                self.cache.clear()
+                self.connected, backoff = True, 1
+
+                while not self._stop_event.is_set():
+                    if select.select([conn], [], [], self.POLL_SECONDS)[0]:
+                        conn.poll()
+                    else:
+                        cur.execute("SELECT 1")     # notice a dead connection
+                    if conn.notifies:
+                        cur.execute("SELECT pg_current_wal_lsn() - '0/0'")
+                        self.lsn = int(cur.fetchone()[0])
+                    while conn.notifies:
+                        self.cache.invalidate(*json.loads(conn.notifies.pop(0).payload))
+                        self.received += 1
+            except (psycopg2.Error, OSError, ValueError):
+                self.reconnects += 1
+            finally:
+                self.connected = False
+                if conn is not None:
+                    conn.close()
+            self._stop_event.wait(backoff)
+            backoff = min(backoff * 2, 60)
@@ -1,8 +1,446 @@
 import psycopg2
+import psycopg2.extensions
+import logging
 import os
+import re
+import threading
+import time
+import weakref
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# -----------------------------------------------------------------------------
+# QUERY INSTRUMENTATION
+# -----------------------------------------------------------------------------
+# Pooled connections hand out InstrumentedCursor, which times every statement.
+# Timings go to the calling thread's QueryTrace (the app starts one per
+# rerun) and anything slower than DB_SLOW_QUERY_MS to the slow-query log.
+SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", "500"))
+SLOW_QUERY_LOG = os.getenv("DB_SLOW_QUERY_LOG", "slow_queries.log")
+
+slow_log = logging.getLogger("finance.slow_queries")
+if SLOW_QUERY_LOG:
+    _handler = logging.FileHandler(SLOW_QUERY_LOG, delay=True)
+    _handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+    slow_log.addHandler(_handler)
+    slow_log.setLevel(logging.INFO)
+    slow_log.propagate = False
+
+_FINGERPRINT_RULES = [
+    (re.compile(r"'(?:[^']|'')*'"), "?"),                         # string literals
+    (re.compile(r"\b\d+(?:\.\d+)?\b"), "?"),                       # numbers
+    (re.compile(r"(\([^()]*\))(?:\s*,\s*\([^()]*\))+"), r"\1, ..."),  # VALUES rows
+    (re.compile(r"\s+"), " "),
+]
+
+
+def fingerprint(query, cur=None):
+    """SQL text with literals and repeated VALUES rows folded, so the same
+    statement with different arguments groups together."""
+    if isinstance(query, bytes):
+        query = query.decode("utf-8", "replace")
+    elif not isinstance(query, str):
+        query = query.as_string(cur)    # psycopg2.sql.Composed
+    for pattern, repl in _FINGERPRINT_RULES:
+        query = pattern.sub(repl, query)
+    return query.strip()
+
+
+class QueryTrace:
+    """Statements one thread ran for one unit of work (a Streamlit rerun)."""
+
+    def __init__(self, page=None):
+        self.page = page
+        self.started = time.perf_counter()
+        self.finished = None
+        self.queries = []       # [(fingerprint, ms, rows)]
+
+    def add(self, fp, ms, rows):
+        self.queries.append((fp, ms, rows))
+
+    def finish(self):
+        self.finished = time.perf_counter()
+        return self
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    @property
+    def db_ms(self):
+        return sum(ms for _, ms, _ in self.queries)
+
+    @property
+    def total_ms(self):
+        return ((self.finished or time.perf_counter()) - self.started) * 1000
+
+    def by_fingerprint(self):
+        """Per-statement totals, slowest first; a high `calls` on one
+        fingerprint is the signature of a per-row loop."""
+        agg = {}
+        for fp, ms, rows in self.queries:
+            a = agg.setdefault(fp, {"query": fp, "calls": 0, "ms": 0.0, "rows": 0})
+            a["calls"] += 1
+            a["ms"] += ms
+            a["rows"] += max(rows, 0)
+        return sorted(agg.values(), key=lambda a: a["ms"], reverse=True)
+
+
+_trace = threading.local()
+
+
+def start_trace(page=None):
+    """Begin a new trace for the calling thread, replacing any previous one."""
+    _trace.current = QueryTrace(page)
+    return _trace.current
+
+
+def current_trace():
+    return getattr(_trace, "current", None)
+
+
+def _record(cur, query, started):
+    ms = (time.perf_counter() - started) * 1000
+    trace = current_trace()
+    if trace is None and ms < SLOW_QUERY_MS:
+        return
+    fp = fingerprint(query, cur)
+    if trace is not None:
+        trace.add(fp, ms, cur.rowcount)
+    if ms >= SLOW_QUERY_MS:
+        slow_log.warning(
+            "%.0f ms | %s rows | page=%s | %s",
+            ms, cur.rowcount, trace.page if trace else None, fp
+        )
+
+
+class InstrumentedCursor(psycopg2.extensions.cursor):
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            _record(self, query, started)
+
+    def executemany(self, query, vars_list):
+        started = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            _record(self, query, started)
+
+    def copy_expert(self, sql, file, size=8192):
+        started = time.perf_counter()
+        try:
+            return super().copy_expert(sql, file, size)
+        finally:
+            _record(self, sql, started)
+
+
+# -----------------------------------------------------------------------------
+# CONNECTION POOL
+# -----------------------------------------------------------------------------
+POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+POOL_MAX = int(os.getenv("DB_POOL_MAX", "20"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+# idle connections older than this are pinged before being handed out
+POOL_HEALTHCHECK_AFTER = float(os.getenv("DB_POOL_HEALTHCHECK_AFTER", "30"))
+POOL_MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", "1800"))
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class PooledConnection:
+    """Checked-out connection. close() hands it back to the pool instead of
+    closing the socket; anything else is forwarded to psycopg2."""
+
+    def __init__(self, pool, raw):
+        self._pool = pool
+        self._raw = raw
+        # pages that st.stop()/st.rerun() before close() still give it back
+        self._finalizer = weakref.finalize(self, pool._release, raw)
+
+    def close(self):
+        self._finalizer()
+
+    @property
+    def closed(self):
+        return not self._finalizer.alive or self._raw.closed
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def __setattr__(self, name, value):
+        if name.startswith("_"):
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._raw, name, value)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self._raw.commit()
+        else:
+            self._raw.rollback()
+        self.close()
+
+
+class ConnectionPool:
+    def __init__(self, dsn, minconn=POOL_MIN, maxconn=POOL_MAX, timeout=POOL_TIMEOUT, **connect_kwargs):
+        self.dsn = dsn
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.connect_kwargs = {"cursor_factory": InstrumentedCursor, **connect_kwargs}
+
+        self._cond = threading.Condition()
+        self._idle = []          # [(conn, created_at, last_used)]
+        self._created = {}       # id(conn) -> created_at
+        self._in_use = 0         # checked out, including ones still connecting
+
+        self.checkouts = 0
+        self.waits = 0
+        self.timeouts = 0
+        self.reconnects = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+
+        for _ in range(minconn):
+            conn = self._connect()
+            self._idle.append((conn, self._created[id(conn)], time.monotonic()))
+
+    def _connect(self):
+        conn = psycopg2.connect(self.dsn, **self.connect_kwargs)
+        self._created[id(conn)] = time.monotonic()
+        return conn
+
+    def _discard(self, conn):
+        self._created.pop(id(conn), None)
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _healthy(self, conn, created, last_used):
+        now = time.monotonic()
+        if conn.closed or now - created > POOL_MAX_LIFETIME:
+            return False
+        if now - last_used < POOL_HEALTHCHECK_AFTER:
+            return True
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1")
+            cur.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self):
+        started = time.monotonic()
+        waited = False
+
+        with self._cond:
+            while True:
+                if self._idle:
+                    conn, created, last_used = self._idle.pop()
+                    self._in_use += 1
+                    break
+                if self._in_use < self.maxconn:
+                    conn = None
+                    self._in_use += 1
+                    break
+
+                waited = True
+                remaining = self.timeout - (time.monotonic() - started)
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise PoolTimeout(
+                        f"no database connection free after {self.timeout:.0f}s "
+                        f"({self.maxconn} in use)"
+                    )
+                self._cond.wait(remaining)
+
+            self.checkouts += 1
+            if waited:
+                elapsed = time.monotonic() - started
+                self.waits += 1
+                self.wait_time += elapsed
+                self.max_wait = max(self.max_wait, elapsed)
+
+        # connect / ping outside the lock so other sessions are not blocked
+        try:
+            if conn is not None and not self._healthy(conn, created, last_used):
+                with self._cond:
+                    self._discard(conn)
+                    self.reconnects += 1
+                conn = None
+            if conn is None:
+                # the slot is already counted in _in_use, so the slow TLS
+                # handshake can happen without holding the lock
+                conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+        return PooledConnection(self, conn)
+
+    def _release(self, conn):
+        keep = not conn.closed
+        if keep:
+            try:
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                if conn.autocommit:
+                    conn.autocommit = False
+            except psycopg2.Error:
+                keep = False
+
+        with self._cond:
+            self._in_use -= 1
+            if keep:
+                self._idle.append((conn, self._created.get(id(conn), time.monotonic()), time.monotonic()))
+            else:
+                self._discard(conn)
+            self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "max": self.maxconn,
+                "checkouts": self.checkouts,
+                "waits": self.waits,
+                "timeouts": self.timeouts,
+                "reconnects": self.reconnects,
+                "avg_wait_ms": round(self.wait_time / self.waits * 1000, 1) if self.waits else 0.0,
+                "max_wait_ms": round(self.max_wait * 1000, 1),
+            }
+
+    def closeall(self):
+        with self._cond:
+            for conn, _, _ in self._idle:
+                self._discard(conn)
+            self._idle = []
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool(**connect_kwargs):
+    """Process-wide pool, created on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool(os.getenv("DATABASE_URL"), **connect_kwargs)
+        return _pool
+
+
 def get_connection():
-    return psycopg2.connect(os.getenv("DATABASE_URL"))
+    return get_pool().getconn()
+
+
+# -----------------------------------------------------------------------------
+# ADVISORY LOCKS
+# -----------------------------------------------------------------------------
+# Keys for pg_advisory_lock, one per job that must not run twice at once.
+# Kept together here so a new one cannot reuse a number already taken.
+MIGRATION_LOCK = 72610001      # db_init.migrate
+PARTITION_LOCK = 72610002      # maintenance.ensure_partitions
+SUMMARY_LOCK = 72610003        # summaries.refresh
+
+
+# -----------------------------------------------------------------------------
+# READ REPLICA
+# -----------------------------------------------------------------------------
+# With DATABASE_REPLICA_URL set to a streaming replica, read-only pages
+# (reports, customer list, dashboard KPIs, statements) are served from it so
+# heavy reads do not compete with collection writes on the primary. Readers
+# pass the primary WAL position they must see (primary_lsn() taken after
+# their own last write); a replica that has not replayed that far yet, or
+# cannot be reached, is passed over for the primary.
+REPLICA_URL = os.getenv("DATABASE_REPLICA_URL")
+# DB_REPLICA_SSLMODE, else the sslmode given in the replica URL, else require
+REPLICA_SSLMODE = os.getenv("DB_REPLICA_SSLMODE") or (
+    psycopg2.extensions.parse_dsn(REPLICA_URL).get("sslmode") if REPLICA_URL else None
+) or "require"
+# after a failed connect the replica is left alone for this long
+REPLICA_RETRY_AFTER = float(os.getenv("DB_REPLICA_RETRY_AFTER", "30"))
+
+_replica_pool = None
+_replica_down_until = 0.0
+_replayed = 0               # furthest replay position seen on the replica
+replica_stats = {"reads": 0, "fallbacks": 0, "errors": 0}
+
+
+def get_replica_pool(**connect_kwargs):
+    """Process-wide replica pool, or None when no replica is configured."""
+    global _replica_pool
+    if not REPLICA_URL:
+        return None
+    with _pool_lock:
+        if _replica_pool is None:
+            # nothing opened up front, so a replica that is down cannot stop the app
+            _replica_pool = ConnectionPool(REPLICA_URL, minconn=0, **connect_kwargs)
+        return _replica_pool
+
+
+def primary_lsn(con):
+    """Current WAL position of the primary, as a number of bytes."""
+    cur = con.cursor()
+    cur.execute("SELECT pg_current_wal_lsn() - '0/0'")
+    lsn = int(cur.fetchone()[0])
+    cur.close()
+    con.rollback()
+    return lsn
+
+
+def _replica_connection(min_lsn, connect_kwargs):
+    global _replica_down_until, _replayed
+    replica = get_replica_pool(**connect_kwargs)
+    if replica is None or time.monotonic() < _replica_down_until:
+        return None
+    try:
+        con = replica.getconn()
+    except (psycopg2.Error, PoolTimeout):
+        replica_stats["errors"] += 1
+        _replica_down_until = time.monotonic() + REPLICA_RETRY_AFTER
+        return None
+
+    if min_lsn > _replayed:
+        try:
+            cur = con.cursor()
+            # NULL when the server is not a standby: only trusted with no writes to wait for
+            cur.execute("SELECT pg_last_wal_replay_lsn() - '0/0'")
+            _replayed = max(_replayed, int(cur.fetchone()[0] or 0))
+            cur.close()
+        except psycopg2.Error:
+            con.close()
+            replica_stats["errors"] += 1
+            return None
+        if min_lsn > _replayed:
+            con.close()
+            return None
+    return con
+
+
+def read_connection(primary, min_lsn=0, **connect_kwargs):
+    """A connection for read-only work: from the replica when one is
+    configured and has replayed up to `min_lsn`, otherwise from the
+    `primary` pool. connect_kwargs are used for the replica pool."""
+    con = _replica_connection(min_lsn, connect_kwargs)
+    if con is not None:
+        replica_stats["reads"] += 1
+        return con
+    if REPLICA_URL:
+        replica_stats["fallbacks"] += 1
+    return primary.getconn()
@@ -1,78 +1,517 @@
-from db import get_connection
+import sys
 
-def create_tables():
-    conn = get_connection()
-    cur = conn.cursor()
+from db import MIGRATION_LOCK, get_connection
+from loans import refresh_balances
+from maintenance import drop_unpartitioned, is_partitioned, partition_daily_collections
+from summaries import build_summaries
 
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS customers (
-        id SERIAL PRIMARY KEY,
-        customer_code VARCHAR(50) UNIQUE,
-        name VARCHAR(100),
-        mobile1 VARCHAR(15),
-        mobile2 VARCHAR(15),
-        address TEXT,
-        reference_name VARCHAR(100),
-        dob DATE,
-        profile_photo TEXT,
-        document_file TEXT,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    );
-    """)
+# -----------------------------------------------------------------------------
+# PYTHON STEPS (for changes that depend on what the server supports)
+# -----------------------------------------------------------------------------
+def _trigram_indexes(cur):
+    """pg_trgm GIN indexes for substring / fuzzy search (skipped when the
+    server does not ship pg_trgm; search then falls back to prefix matches)"""
+    cur.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+    if not cur.fetchone():
+        print("   pg_trgm not available, using prefix indexes only")
+        return
+    cur.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for column in ("name", "customer_code", "mobile1", "second_mobile"):
+        cur.execute(
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_customers_{column}_trgm "
+            f"ON customers USING gin ({column} gin_trgm_ops)"
+        )
 
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS loans (
-        id SERIAL PRIMARY KEY,
-        customer_id INT REFERENCES customers(id),
-        total_amount INT,
-        amount_given INT,
-        interest INT,
-        daily_amount INT,
-        duration_days INT,
-        loan_date DATE,
-        start_date DATE,
-        end_date DATE,
-        status VARCHAR(20),
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    );
-    """)
 
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS daily_collections (
-        id SERIAL PRIMARY KEY,
-        loan_id INT REFERENCES loans(id),
-        collection_date DATE,
-        amount_due INT,
-        amount_paid INT DEFAULT 0,
-        status VARCHAR(20),
-        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    );
-    """)
+def _dc_updated_at_index(cur):
+    """idx_dc_updated_at, built concurrently one partition at a time
 
+    A partitioned table takes no CREATE INDEX CONCURRENTLY, so the parent
+    index is created ON ONLY (empty and invalid), each partition gets its own
+    index concurrently and is attached; the parent turns valid once every
+    partition is. Partitions created later inherit the index on ATTACH."""
+    if not is_partitioned(cur):
+        cur.execute("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_dc_updated_at ON daily_collections (updated_at)")
+        return
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_dc_updated_at ON ONLY daily_collections (updated_at)")
     cur.execute("""
-    CREATE TABLE IF NOT EXISTS audit_logs (
-        id SERIAL PRIMARY KEY,
-        loan_id INT,
-        collection_date DATE,
-        old_amount INT,
-        new_amount INT,
-        edited_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    );
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'daily_collections'::regclass
+          AND NOT EXISTS (
+              SELECT 1 FROM pg_inherits x
+              JOIN pg_index ix ON ix.indexrelid = x.inhrelid
+              WHERE x.inhparent = 'idx_dc_updated_at'::regclass AND ix.indrelid = c.oid
+          )
+        ORDER BY 1
     """)
+    for (part,) in cur.fetchall():
+        cur.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {part}_updated_at_idx ON {part} (updated_at)")
+        cur.execute(f"ALTER INDEX idx_dc_updated_at ATTACH PARTITION {part}_updated_at_idx")
+
+
+def _backfill_balances(cur):
+    """fill paid_total / last_paid_date / arrears from the schedule history"""
+    refresh_balances(cur)
+
+
+# -----------------------------------------------------------------------------
+# MIGRATIONS
+# -----------------------------------------------------------------------------
+# Append new steps to the end, never edit an applied one. Every statement must
+# be idempotent so a half-applied step can simply be re-run. Steps marked
+# concurrent run outside a transaction (CREATE INDEX CONCURRENTLY), so they
+# can be applied to the live database without blocking collectors.
+
+MIGRATIONS = [
+    (1, "base tables", False, [
+        """
+        CREATE TABLE IF NOT EXISTS customers (
+            id SERIAL PRIMARY KEY,
+            customer_code VARCHAR(50) UNIQUE,
+            name VARCHAR(100),
+            mobile1 VARCHAR(15),
+            mobile2 VARCHAR(15),
+            address TEXT,
+            reference_name VARCHAR(100),
+            dob DATE,
+            profile_photo TEXT,
+            document_file TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS loans (
+            id SERIAL PRIMARY KEY,
+            customer_id INT REFERENCES customers(id),
+            total_amount INT,
+            amount_given INT,
+            interest INT,
+            daily_amount INT,
+            duration_days INT,
+            loan_date DATE,
+            start_date DATE,
+            end_date DATE,
+            status VARCHAR(20),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS daily_collections (
+            id SERIAL PRIMARY KEY,
+            loan_id INT REFERENCES loans(id),
+            collection_date DATE,
+            amount_due INT,
+            amount_paid INT DEFAULT 0,
+            status VARCHAR(20),
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS audit_logs (
+            id SERIAL PRIMARY KEY,
+            loan_id INT,
+            collection_date DATE,
+            old_amount INT,
+            new_amount INT,
+            edited_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id SERIAL PRIMARY KEY,
+            username VARCHAR(50) UNIQUE,
+            password_hash TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """,
+    ]),
+
+    (2, "columns written by the app", False, [
+        "ALTER TABLE customers ADD COLUMN IF NOT EXISTS aadhar_number VARCHAR(20)",
+        "ALTER TABLE customers ADD COLUMN IF NOT EXISTS second_mobile VARCHAR(15)",
+        "ALTER TABLE customers ADD COLUMN IF NOT EXISTS referral_name VARCHAR(100)",
+        "ALTER TABLE loans ADD COLUMN IF NOT EXISTS actual_given INT",
+    ]),
+
+    (3, "indexes for collection, customer and report queries", True, [
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_dc_date_loan ON daily_collections (collection_date, loan_id)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_dc_loan_date ON daily_collections (loan_id, collection_date)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_loans_customer_status ON loans (customer_id, status)",
+    ]),
+
+    (4, "customer list keyset index", True, [
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_customers_created_id ON customers (created_at, id)",
+    ]),
+
+    (5, "customer search indexes", True, [
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_customers_name_prefix ON customers (lower(name) text_pattern_ops)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_customers_code_prefix ON customers (lower(customer_code) text_pattern_ops)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_customers_mobile1_prefix ON customers (mobile1 text_pattern_ops)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_customers_mobile2_prefix ON customers (second_mobile text_pattern_ops)",
+        _trigram_indexes,
+    ]),
+
+    (6, "payments ledger and derived schedule", False, [
+        "ALTER TABLE loans ADD COLUMN IF NOT EXISTS schedule_mode VARCHAR(12) NOT NULL DEFAULT 'materialized'",
+        """
+        CREATE TABLE IF NOT EXISTS payments (
+            id BIGSERIAL PRIMARY KEY,
+            loan_id INT NOT NULL REFERENCES loans(id),
+            collection_date DATE NOT NULL,
+            amount_paid INT NOT NULL,
+            recorded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_payments_loan_date ON payments (loan_id, collection_date, id)",
+        "CREATE INDEX IF NOT EXISTS idx_payments_date ON payments (collection_date)",
+        # every schedule row of every loan, whichever way it is stored;
+        # meant for per-loan reads: filter on loan_id so it is pushed down
+        # into both branches
+        """
+        CREATE OR REPLACE VIEW collection_schedule AS
+        SELECT dc.loan_id, dc.collection_date, dc.amount_due, dc.amount_paid,
+               dc.status::text AS status, dc.updated_at
+        FROM daily_collections dc
+        UNION ALL
+        SELECT l.id, s.d::date, l.daily_amount,
+               COALESCE(p.amount_paid, 0),
+               CASE WHEN COALESCE(p.amount_paid, 0) > 0 THEN 'Paid' ELSE 'Pending' END,
+               p.recorded_at
+        FROM loans l
+        CROSS JOIN LATERAL generate_series(l.start_date, l.end_date, interval '1 day') s(d)
+        LEFT JOIN LATERAL (
+            SELECT p.amount_paid, p.recorded_at
+            FROM payments p
+            WHERE p.loan_id = l.id AND p.collection_date = s.d::date
+            ORDER BY p.id DESC
+            LIMIT 1
+        ) p ON true
+        WHERE l.schedule_mode = 'ledger';
+        """,
+        # the same rows restricted to a date range; ledger schedules are only
+        # generated for the days inside the range
+        """
+        CREATE OR REPLACE FUNCTION collection_schedule_between(d_from DATE, d_to DATE)
+        RETURNS TABLE (loan_id INT, collection_date DATE, amount_due INT, amount_paid INT,
+                       status TEXT, updated_at TIMESTAMP)
+        LANGUAGE sql STABLE AS $$
+            SELECT dc.loan_id, dc.collection_date, dc.amount_due, dc.amount_paid,
+                   dc.status::text, dc.updated_at
+            FROM daily_collections dc
+            WHERE dc.collection_date BETWEEN d_from AND d_to
+            UNION ALL
+            SELECT l.id, s.d::date, l.daily_amount,
+                   COALESCE(p.amount_paid, 0),
+                   CASE WHEN COALESCE(p.amount_paid, 0) > 0 THEN 'Paid' ELSE 'Pending' END,
+                   p.recorded_at
+            FROM loans l
+            CROSS JOIN LATERAL generate_series(
+                GREATEST(l.start_date, d_from), LEAST(l.end_date, d_to), interval '1 day'
+            ) s(d)
+            LEFT JOIN (
+                SELECT DISTINCT ON (p.loan_id, p.collection_date)
+                       p.loan_id, p.collection_date, p.amount_paid, p.recorded_at
+                FROM payments p
+                WHERE p.collection_date BETWEEN d_from AND d_to
+                ORDER BY p.loan_id, p.collection_date, p.id DESC
+            ) p ON p.loan_id = l.id AND p.collection_date = s.d::date
+            WHERE l.schedule_mode = 'ledger'
+              AND l.start_date <= d_to AND l.end_date >= d_from
+        $$;
+        """,
+    ]),
+
+    (7, "running balances on loans", False, [
+        "ALTER TABLE loans ADD COLUMN IF NOT EXISTS paid_total INT NOT NULL DEFAULT 0",
+        "ALTER TABLE loans ADD COLUMN IF NOT EXISTS last_paid_date DATE",
+        "ALTER TABLE loans ADD COLUMN IF NOT EXISTS arrears INT NOT NULL DEFAULT 0",
+        _backfill_balances,
+    ]),
+
+    (8, "arrears index", True, [
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_loans_active_arrears
+        ON loans (arrears DESC) INCLUDE (customer_id, paid_total, last_paid_date)
+        WHERE status = 'Active'
+        """,
+    ]),
+
+    (9, "audit log details", False, [
+        "ALTER TABLE audit_logs ADD COLUMN IF NOT EXISTS action VARCHAR(20)",
+        "ALTER TABLE audit_logs ADD COLUMN IF NOT EXISTS customer_id INT",
+        "ALTER TABLE audit_logs ADD COLUMN IF NOT EXISTS details JSONB",
+        "ALTER TABLE audit_logs ADD COLUMN IF NOT EXISTS edited_by VARCHAR(50)",
+    ]),
+
+    (10, "audit log indexes", True, [
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_audit_edited_at ON audit_logs (edited_at)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_audit_loan_edited_at ON audit_logs (loan_id, edited_at)",
+    ]),
 
+    # one row per payment received through sync_api.py, keyed by the
+    # client's idempotency key so a retried upload is never applied twice
+    (11, "sync idempotency keys", False, [
+        """
+        CREATE TABLE IF NOT EXISTS sync_keys (
+            idempotency_key VARCHAR(100) PRIMARY KEY,
+            loan_id INT NOT NULL,
+            collection_date DATE NOT NULL,
+            amount_paid INT NOT NULL,
+            edited_by VARCHAR(50),
+            received_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """,
+    ]),
+
+    # daily_collections partitioned by month (maintenance.py keeps future
+    # months created) and archive tables for closed loans moved out of it;
+    # the view and function gain an archive branch and skip archived ledger
+    # loans, whose schedules are kept in daily_collections_archive instead.
+    # Takes daily_collections offline while it runs, see
+    # maintenance.partition_daily_collections
+    (12, "monthly partitions for daily_collections, archive tables", False, [
+        "ALTER TABLE loans ADD COLUMN IF NOT EXISTS archived_at TIMESTAMP",
+        """
+        CREATE TABLE IF NOT EXISTS daily_collections_archive (
+            loan_id INT NOT NULL,
+            collection_date DATE NOT NULL,
+            amount_due INT,
+            amount_paid INT,
+            status VARCHAR(20),
+            updated_at TIMESTAMP
+        );
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_dca_loan_date ON daily_collections_archive (loan_id, collection_date)",
+        "CREATE INDEX IF NOT EXISTS idx_dca_date ON daily_collections_archive (collection_date)",
+        "CREATE TABLE IF NOT EXISTS payments_archive (LIKE payments INCLUDING DEFAULTS)",
+        "CREATE INDEX IF NOT EXISTS idx_pa_loan_date ON payments_archive (loan_id, collection_date)",
+        partition_daily_collections,
+        """
+        CREATE OR REPLACE VIEW collection_schedule AS
+        SELECT dc.loan_id, dc.collection_date, dc.amount_due, dc.amount_paid,
+               dc.status::text AS status, dc.updated_at
+        FROM daily_collections dc
+        UNION ALL
+        SELECT l.id, s.d::date, l.daily_amount,
+               COALESCE(p.amount_paid, 0),
+               CASE WHEN COALESCE(p.amount_paid, 0) > 0 THEN 'Paid' ELSE 'Pending' END,
+               p.recorded_at
+        FROM loans l
+        CROSS JOIN LATERAL generate_series(l.start_date, l.end_date, interval '1 day') s(d)
+        LEFT JOIN LATERAL (
+            SELECT p.amount_paid, p.recorded_at
+            FROM payments p
+            WHERE p.loan_id = l.id AND p.collection_date = s.d::date
+            ORDER BY p.id DESC
+            LIMIT 1
+        ) p ON true
+        WHERE l.schedule_mode = 'ledger' AND l.archived_at IS NULL
+        UNION ALL
+        SELECT a.loan_id, a.collection_date, a.amount_due, a.amount_paid,
+               a.status::text, a.updated_at
+        FROM daily_collections_archive a;
+        """,
+        """
+        CREATE OR REPLACE FUNCTION collection_schedule_between(d_from DATE, d_to DATE)
+        RETURNS TABLE (loan_id INT, collection_date DATE, amount_due INT, amount_paid INT,
+                       status TEXT, updated_at TIMESTAMP)
+        LANGUAGE sql STABLE AS $$
+            SELECT dc.loan_id, dc.collection_date, dc.amount_due, dc.amount_paid,
+                   dc.status::text, dc.updated_at
+            FROM daily_collections dc
+            WHERE dc.collection_date BETWEEN d_from AND d_to
+            UNION ALL
+            SELECT l.id, s.d::date, l.daily_amount,
+                   COALESCE(p.amount_paid, 0),
+                   CASE WHEN COALESCE(p.amount_paid, 0) > 0 THEN 'Paid' ELSE 'Pending' END,
+                   p.recorded_at
+            FROM loans l
+            CROSS JOIN LATERAL generate_series(
+                GREATEST(l.start_date, d_from), LEAST(l.end_date, d_to), interval '1 day'
+            ) s(d)
+            LEFT JOIN (
+                SELECT DISTINCT ON (p.loan_id, p.collection_date)
+                       p.loan_id, p.collection_date, p.amount_paid, p.recorded_at
+                FROM payments p
+                WHERE p.collection_date BETWEEN d_from AND d_to
+                ORDER BY p.loan_id, p.collection_date, p.id DESC
+            ) p ON p.loan_id = l.id AND p.collection_date = s.d::date
+            WHERE l.schedule_mode = 'ledger' AND l.archived_at IS NULL
+              AND l.start_date <= d_to AND l.end_date >= d_from
+            UNION ALL
+            SELECT a.loan_id, a.collection_date, a.amount_due, a.amount_paid,
+                   a.status::text, a.updated_at
+            FROM daily_collections_archive a
+            WHERE a.collection_date BETWEEN d_from AND d_to
+        $$;
+        """,
+        drop_unpartitioned,
+        # indexes on the parent cascade to every partition, present and future
+        "CREATE INDEX IF NOT EXISTS idx_dc_date_loan ON daily_collections (collection_date, loan_id)",
+        "CREATE INDEX IF NOT EXISTS idx_dc_loan_date ON daily_collections (loan_id, collection_date)",
+        "ANALYZE daily_collections",
+    ]),
+
+    # totals kept up to date by summaries.py from the write timestamps;
+    # loans get one too so edits and closes are picked up
+    (13, "summary tables", False, [
+        # existing loans stay NULL, only new writes count as changes
+        "ALTER TABLE loans ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP",
+        "ALTER TABLE loans ALTER COLUMN updated_at SET DEFAULT CURRENT_TIMESTAMP",
+        """
+        CREATE TABLE IF NOT EXISTS summary_daily (
+            collection_date DATE PRIMARY KEY,
+            amount_due BIGINT NOT NULL,
+            amount_paid BIGINT NOT NULL,
+            loans_due INT NOT NULL,
+            loans_paid INT NOT NULL
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS summary_customer_month (
+            customer_id INT NOT NULL,
+            month DATE NOT NULL,
+            amount_due BIGINT NOT NULL,
+            amount_paid BIGINT NOT NULL,
+            PRIMARY KEY (customer_id, month)
+        );
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_scm_month ON summary_customer_month (month)",
+        """
+        CREATE TABLE IF NOT EXISTS summary_loans (
+            loan_id INT PRIMARY KEY,
+            customer_id INT NOT NULL,
+            first_date DATE NOT NULL,
+            last_date DATE NOT NULL,
+            amount_due BIGINT NOT NULL,
+            amount_paid BIGINT NOT NULL
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS summary_state (
+            name VARCHAR(50) PRIMARY KEY,
+            watermark TIMESTAMP NOT NULL,
+            refreshed_at TIMESTAMP NOT NULL
+        );
+        """,
+        build_summaries,
+    ]),
+
+    # the write-timestamp indexes summaries.py looks changes up by
+    (14, "summary change indexes", True, [
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_loans_updated_at ON loans (updated_at)",
+        _dc_updated_at_index,
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_payments_recorded_at ON payments (recorded_at)",
+    ]),
+]
+
+
+def _drop_invalid_indexes(cur):
+    """A failed CREATE INDEX CONCURRENTLY leaves an INVALID index behind that
+    IF NOT EXISTS would happily skip; drop those so the step rebuilds them.
+    Partitioned indexes are left alone: they are invalid until every
+    partition's index is attached, which re-running the step finishes."""
     cur.execute("""
-    CREATE TABLE IF NOT EXISTS users (
-        id SERIAL PRIMARY KEY,
-        username VARCHAR(50) UNIQUE,
-        password_hash TEXT,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    );
+        SELECT i.relname
+        FROM pg_index x
+        JOIN pg_class i ON i.oid = x.indexrelid
+        JOIN pg_namespace n ON n.oid = i.relnamespace
+        WHERE NOT x.indisvalid AND n.nspname = current_schema() AND i.relkind <> 'I'
     """)
+    for (name,) in cur.fetchall():
+        cur.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"')
+
+
+def _run(cur, step):
+    if callable(step):
+        step(cur)
+    else:
+        cur.execute(step)
+
+
+def _describe(step):
+    if callable(step):
+        return (step.__doc__ or "python step").split("\n")[0]
+    return " ".join(step.split())
+
+
+def applied_versions(cur, create=True):
+    if not create:
+        cur.execute("SELECT to_regclass('schema_version') IS NOT NULL")
+        if not cur.fetchone()[0]:
+            return set()
+    else:
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INT PRIMARY KEY,
+            description TEXT,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """)
+    cur.execute("SELECT version FROM schema_version")
+    return {r[0] for r in cur.fetchall()}
+
+
+def migrate(dry_run=False):
+    conn = get_connection()
+    conn.autocommit = True
+    cur = conn.cursor()
+
+    cur.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK,))
+    try:
+        done = applied_versions(cur, create=not dry_run)
+        pending = [m for m in MIGRATIONS if m[0] not in done]
+
+        if not pending:
+            print("✅ Schema is up to date")
+            return []
+
+        for version, description, concurrent, statements in pending:
+            print(f"→ {version}: {description}")
+            if dry_run:
+                for sql in statements:
+                    print("   " + _describe(sql))
+                continue
+
+            if concurrent:
+                _drop_invalid_indexes(cur)
+                for sql in statements:
+                    _run(cur, sql)
+                cur.execute(
+                    "INSERT INTO schema_version (version, description) VALUES (%s,%s)",
+                    (version, description)
+                )
+            else:
+                cur.execute("BEGIN")
+                try:
+                    for sql in statements:
+                        _run(cur, sql)
+                    cur.execute(
+                        "INSERT INTO schema_version (version, description) VALUES (%s,%s)",
+                        (version, description)
+                    )
+                    cur.execute("COMMIT")
+                except Exception:
+                    cur.execute("ROLLBACK")
+                    raise
+
+        return [m[0] for m in pending]
+    finally:
+        cur.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK,))
+        cur.close()
+        conn.close()
+
+
+def create_tables():
+    migrate()
 
-    conn.commit()
-    cur.close()
-    conn.close()
 
 if __name__ == "__main__":
-    create_tables()
-    print("✅ Tables created successfully")
+    dry_run = "--dry-run" in sys.argv
+    applied = migrate(dry_run=dry_run)
+    if applied and dry_run:
+        print("ℹ️ Dry run – nothing was changed")
+    elif applied:
+        print(f"✅ Applied migrations: {', '.join(map(str, applied))}")
@@ -0,0 +1,211 @@
+# =============================================================================
+# BULK CUSTOMER / LOAN IMPORT
+# =============================================================================
+# One CSV row per customer, optionally with a loan. The whole file is
+# validated column by column first and every problem is reported together;
+# a clean file is COPYed into temporary staging tables and moved into
+# customers / loans / daily_collections with a few set-based statements in
+# one transaction, so either every row is imported or none is.
+
+import io
+import sys
+
+import pandas as pd
+
+from cache import notify
+from loans import SCHEDULE_MODE, arrears_sql
+
+CUSTOMER_COLUMNS = [
+    "customer_code", "name", "mobile1", "second_mobile", "aadhar_number",
+    "address", "reference_name", "referral_name",
+]
+LOAN_COLUMNS = [
+    "total_amount", "interest", "actual_given", "daily_amount", "duration_days", "loan_date",
+]
+COLUMNS = CUSTOMER_COLUMNS + LOAN_COLUMNS
+REQUIRED = ["customer_code", "name"]
+# a row with any loan column filled in must have all of these
+LOAN_REQUIRED = ["total_amount", "daily_amount", "duration_days", "loan_date"]
+LOAN_INTS = ["total_amount", "interest", "actual_given", "daily_amount", "duration_days"]
+# column widths in the customers table
+MAX_LENGTH = {
+    "customer_code": 50, "name": 100, "mobile1": 15, "second_mobile": 15,
+    "aadhar_number": 20, "reference_name": 100, "referral_name": 100,
+}
+
+TEMPLATE = ",".join(COLUMNS) + "\n"
+
+
+def read_csv(f):
+    """Everything as text, blanks as None; line numbers match the file."""
+    df = pd.read_csv(f, dtype=str, keep_default_na=False, skipinitialspace=True)
+    df.columns = [c.strip().lower() for c in df.columns]
+    df = df.apply(lambda s: s.str.strip()).replace("", None)
+    df.index = df.index + 2     # header is line 1
+    return df
+
+
+def validate(df, con=None):
+    """Check every row at once. Returns (rows, errors): rows has one column
+    per COLUMNS entry with proper types, errors is a DataFrame of
+    line / column / error (empty when the file can be imported). With a
+    connection, customer codes that already exist are reported too."""
+    errors = []
+
+    def fail(mask, column, message):
+        for line in df.index[mask]:
+            errors.append((line, column, message))
+
+    missing = [c for c in REQUIRED if c not in df.columns]
+    if missing:
+        errors.append((1, ", ".join(missing), "missing column"))
+        return df, pd.DataFrame(errors, columns=["line", "column", "error"])
+
+    text = df.reindex(columns=COLUMNS).astype("string")
+    rows = text.copy()
+
+    for c in REQUIRED:
+        fail(rows[c].isna(), c, "required")
+    fail(rows["customer_code"].duplicated(keep=False) & rows["customer_code"].notna(),
+         "customer_code", "duplicate in file")
+    for c, n in MAX_LENGTH.items():
+        fail(rows[c].str.len() > n, c, f"longer than {n} characters")
+    for c in ["mobile1", "second_mobile"]:
+        fail(rows[c].notna() & ~rows[c].str.fullmatch(r"\+?\d{10,15}", na=False), c, "not a phone number")
+
+    for c in LOAN_INTS:
+        rows[c] = pd.to_numeric(text[c], errors="coerce")
+        bad = text[c].notna() & (rows[c].isna() | (rows[c] < 0) | (rows[c] % 1 != 0))
+        fail(bad, c, "must be a whole number ≥ 0")
+    # 2026-10-01 or 01/10/2026
+    iso = pd.to_datetime(text["loan_date"], format="%Y-%m-%d", errors="coerce")
+    dmy = pd.to_datetime(text["loan_date"], format="%d/%m/%Y", errors="coerce")
+    rows["loan_date"] = iso.fillna(dmy).dt.date
+    fail(text["loan_date"].notna() & iso.isna() & dmy.isna(), "loan_date", "not a date (YYYY-MM-DD or DD/MM/YYYY)")
+
+    has_loan = text[LOAN_COLUMNS].notna().any(axis=1)
+    for c in LOAN_REQUIRED:
+        fail(has_loan & text[c].isna(), c, "required for a loan")
+    fail(has_loan & (rows["daily_amount"] == 0), "daily_amount", "must be more than 0")
+    fail(has_loan & (rows["duration_days"] == 0), "duration_days", "must be more than 0")
+
+    if con is not None:
+        codes = rows["customer_code"].dropna().tolist()
+        cur = con.cursor()
+        cur.execute("SELECT customer_code FROM customers WHERE customer_code = ANY(%s)", (codes,))
+        existing = {r[0] for r in cur.fetchall()}
+        cur.close()
+        fail(rows["customer_code"].isin(existing), "customer_code", "already exists")
+
+    errors = pd.DataFrame(errors, columns=["line", "column", "error"]).sort_values(["line", "column"])
+    return rows, errors.reset_index(drop=True)
+
+
+def _copy(cur, table, df):
+    buf = io.StringIO()
+    df.to_csv(buf, index=True, header=False)
+    buf.seek(0)
+    cur.copy_expert(f"COPY {table} FROM STDIN WITH (FORMAT csv)", buf)
+
+
+def load(con, rows, mode=None, user=None):
+    """Import validated rows in one transaction; returns (customers, loans)."""
+    mode = mode or SCHEDULE_MODE
+    loan_rows = rows[rows[LOAN_REQUIRED].notna().all(axis=1)]
+    cur = con.cursor()
+
+    cur.execute("""
+        CREATE TEMP TABLE import_customers (
+            line INT, customer_code VARCHAR(50), name VARCHAR(100),
+            mobile1 VARCHAR(15), second_mobile VARCHAR(15), aadhar_number VARCHAR(20),
+            address TEXT, reference_name VARCHAR(100), referral_name VARCHAR(100)
+        ) ON COMMIT DROP;
+        CREATE TEMP TABLE import_loans (
+            line INT, customer_code VARCHAR(50),
+            total_amount INT, interest INT, actual_given INT,
+            daily_amount INT, duration_days INT, loan_date DATE
+        ) ON COMMIT DROP;
+    """)
+    _copy(cur, "import_customers", rows[CUSTOMER_COLUMNS])
+    _copy(cur, "import_loans", loan_rows[["customer_code"] + LOAN_COLUMNS].astype(
+        {c: "Int64" for c in LOAN_INTS}
+    ))
+
+    cur.execute("""
+        INSERT INTO customers
+        (customer_code, name, mobile1, second_mobile, aadhar_number,
+         address, reference_name, referral_name)
+        SELECT customer_code, name, mobile1, second_mobile, aadhar_number,
+               address, reference_name, referral_name
+        FROM import_customers
+        ORDER BY line
+    """)
+    customers = cur.rowcount
+
+    # loans, then every materialized schedule in the same statement
+    cur.execute("""
+        WITH new AS (
+            INSERT INTO loans
+            (customer_id, total_amount, interest, actual_given,
+             daily_amount, duration_days,
+             loan_date, start_date, end_date, status, schedule_mode)
+            SELECT c.id, i.total_amount, i.interest,
+                   COALESCE(i.actual_given, i.total_amount - COALESCE(i.interest, 0)),
+                   i.daily_amount, i.duration_days,
+                   i.loan_date, i.loan_date + 1, i.loan_date + i.duration_days, 'Active', %s
+            FROM import_loans i
+            JOIN customers c ON c.customer_code = i.customer_code
+            ORDER BY i.line
+            RETURNING id, daily_amount, start_date, end_date, schedule_mode
+        ),
+        sched AS (
+            INSERT INTO daily_collections (loan_id, collection_date, amount_due, amount_paid, status)
+            SELECT new.id, d::date, new.daily_amount, 0, 'Pending'
+            FROM new
+            CROSS JOIN generate_series(new.start_date, new.end_date, interval '1 day') d
+            WHERE new.schedule_mode = 'materialized'
+        )
+        SELECT id FROM new
+    """, (mode,))
+    loan_ids = [r[0] for r in cur.fetchall()]
+
+    # nothing is paid yet, so loans given in the past start in arrears
+    cur.execute(f"""
+        UPDATE loans l SET arrears = {arrears_sql("0")}
+        WHERE l.id = ANY(%s)
+    """, (loan_ids,))
+
+    cur.execute("""
+        INSERT INTO audit_logs (action, details, edited_by)
+        VALUES ('customer_import', jsonb_build_object('customers', %s, 'loans', %s), %s)
+    """, (customers, len(loan_ids), user))
+    notify(cur, "customers", "loans", "collections")
+
+    con.commit()
+    cur.close()
+    return customers, len(loan_ids)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from db import get_connection
+
+    parser = argparse.ArgumentParser(description="Import customers and loans from a CSV file")
+    parser.add_argument("file")
+    parser.add_argument("--dry-run", action="store_true", help="only validate the file")
+    parser.add_argument("--mode", choices=["materialized", "ledger"], default=SCHEDULE_MODE)
+    args = parser.parse_args()
+
+    conn = get_connection()
+    rows, errors = validate(read_csv(args.file), conn)
+    if not errors.empty:
+        print(errors.to_string(index=False))
+        print(f"❌ {len(errors)} problems – nothing was imported")
+        sys.exit(1)
+    if args.dry_run:
+        print(f"✅ {len(rows)} rows are valid")
+    else:
+        customers, loans = load(conn, rows, args.mode)
+        print(f"✅ Imported {customers} customers and {loans} loans")
+    conn.close()
@@ -0,0 +1,453 @@
+# =============================================================================
+# LOAN WRITES SHARED BY THE APP AND SCRIPTS
+# =============================================================================
+# Loans store their schedule in one of two ways (loans.schedule_mode):
+#
+#   materialized – one daily_collections row per scheduled day, written up
+#                  front and updated in place (the original layout)
+#   ledger       – nothing is written up front; the schedule is derived from
+#                  start_date / end_date / daily_amount and only actual
+#                  payments are appended to the payments ledger
+#
+# Readers never care which: they go through the collection_schedule view or
+# the collection_schedule_between() function (see db_init.py).
+
+import os
+import sys
+from datetime import timedelta
+
+from psycopg2.extras import execute_values
+
+from cache import notify
+
+SCHEDULE_MODE = os.getenv("SCHEDULE_MODE", "materialized")
+
+# loan columns whose before/after values go into audit_logs on an edit
+AUDITED_LOAN_FIELDS = (
+    "total_amount, interest, actual_given, daily_amount, duration_days, "
+    "loan_date, start_date, end_date"
+)
+
+
+def loan_dates(loan_date, days):
+    """Collection starts the day after the loan is given."""
+    start = loan_date + timedelta(days=1)
+    end = start + timedelta(days=days - 1)
+    return start, end
+
+
+def create_schedule(cur, loan_id, start_date, days, daily_amount):
+    """Write the whole daily_collections schedule in one statement."""
+    cur.execute("""
+        INSERT INTO daily_collections (loan_id, collection_date, amount_due, amount_paid, status)
+        SELECT %s, d::date, %s, 0, 'Pending'
+        FROM generate_series(%s::date, %s::date + (%s - 1), interval '1 day') d
+    """, (int(loan_id), int(daily_amount), start_date, start_date, int(days)))
+
+
+def restore_archived(cur, loan_ids):
+    """Bring archived loans back into the live tables before they are written
+    to (see maintenance.archive_closed_loans); a no-op for everything else."""
+    cur.execute("""
+        UPDATE loans SET archived_at = NULL
+        WHERE id = ANY(%s) AND archived_at IS NOT NULL
+        RETURNING id, schedule_mode
+    """, ([int(i) for i in loan_ids],))
+    restored = cur.fetchall()
+    if not restored:
+        return
+    ids = [r[0] for r in restored]
+    materialized = [r[0] for r in restored if r[1] == "materialized"]
+    cur.execute("""
+        WITH moved AS (DELETE FROM daily_collections_archive WHERE loan_id = ANY(%s) RETURNING *)
+        INSERT INTO daily_collections (loan_id, collection_date, amount_due, amount_paid, status, updated_at)
+        SELECT loan_id, collection_date, amount_due, amount_paid, status, updated_at
+        FROM moved
+        WHERE loan_id = ANY(%s)
+    """, (ids, materialized))
+    cur.execute("""
+        WITH moved AS (DELETE FROM payments_archive WHERE loan_id = ANY(%s) RETURNING *)
+        INSERT INTO payments SELECT * FROM moved
+    """, (ids,))
+
+
+def create_loan(cur, customer_id, total_amount, daily_amount, duration_days, loan_date,
+                interest=None, actual_given=None, mode=None):
+    mode = mode or SCHEDULE_MODE
+    start, end = loan_dates(loan_date, duration_days)
+    cur.execute("""
+        INSERT INTO loans
+        (customer_id, total_amount, interest, actual_given,
+         daily_amount, duration_days,
+         loan_date, start_date, end_date, status, schedule_mode)
+        VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,'Active',%s)
+        RETURNING id
+    """, (
+        int(customer_id),
+        total_amount, interest, actual_given,
+        daily_amount, duration_days,
+        loan_date, start, end, mode
+    ))
+    loan_id = cur.fetchone()[0]
+
+    if mode == "materialized":
+        create_schedule(cur, loan_id, start, duration_days, daily_amount)
+    notify(cur, "loans", "collections")
+    return loan_id
+
+
+def update_loan(cur, loan_id, total_amount, interest, actual_given,
+                daily_amount, duration_days, loan_date, user=None):
+    """Edit a loan before collection starts. Ledger loans are a single-row
+    update; materialized ones get their schedule regenerated."""
+    restore_archived(cur, [loan_id])
+    start, end = loan_dates(loan_date, duration_days)
+    cur.execute(f"""
+        WITH old AS (
+            SELECT {AUDITED_LOAN_FIELDS} FROM loans WHERE id=%s
+        ),
+        upd AS (
+            UPDATE loans
+            SET total_amount=%s, interest=%s, actual_given=%s,
+                daily_amount=%s, duration_days=%s,
+                loan_date=%s, start_date=%s, end_date=%s,
+                updated_at=CURRENT_TIMESTAMP
+            WHERE id=%s
+            RETURNING id, schedule_mode, {AUDITED_LOAN_FIELDS}
+        ),
+        aud AS (
+            INSERT INTO audit_logs (action, loan_id, details, edited_by)
+            SELECT 'loan_edit', upd.id,
+                   jsonb_build_object('old', to_jsonb(old), 'new', to_jsonb(upd) - 'id' - 'schedule_mode'),
+                   %s
+            FROM old, upd
+        )
+        SELECT schedule_mode FROM upd
+    """, (int(loan_id), total_amount, interest, actual_given, daily_amount, duration_days,
+          loan_date, start, end, int(loan_id), user))
+
+    if cur.fetchone()[0] == "materialized":
+        cur.execute("DELETE FROM daily_collections WHERE loan_id=%s", (int(loan_id),))
+        create_schedule(cur, loan_id, start, duration_days, daily_amount)
+    refresh_balances(cur, [loan_id])
+    notify(cur, "loans", "collections", f"loan:{loan_id}")
+
+
+def close_loan(cur, loan_id, close_amount, close_date, user=None):
+    """Close a loan: the schedule ends at close_date and the last remaining
+    day is recorded as paid with the settlement amount."""
+    restore_archived(cur, [loan_id])
+    cur.execute("""
+        WITH old AS (
+            SELECT status, end_date, paid_total FROM loans WHERE id=%s
+        ),
+        upd AS (
+            UPDATE loans
+            SET status='Closed', end_date=LEAST(end_date, %s), updated_at=CURRENT_TIMESTAMP
+            WHERE id=%s
+            RETURNING id, schedule_mode, status, end_date
+        ),
+        aud AS (
+            INSERT INTO audit_logs (action, loan_id, collection_date, new_amount, details, edited_by)
+            SELECT 'loan_close', upd.id, upd.end_date, %s,
+                   jsonb_build_object('old', to_jsonb(old),
+                                      'new', jsonb_build_object('status', upd.status, 'end_date', upd.end_date)),
+                   %s
+            FROM old, upd
+        )
+        SELECT schedule_mode, end_date FROM upd
+    """, (int(loan_id), close_date, int(loan_id), int(close_amount), user))
+    mode, end_date = cur.fetchone()
+
+    if mode == "ledger":
+        cur.execute("""
+            INSERT INTO payments (loan_id, collection_date, amount_paid)
+            VALUES (%s,%s,%s)
+        """, (int(loan_id), end_date, int(close_amount)))
+    else:
+        cur.execute("""
+            DELETE FROM daily_collections
+            WHERE loan_id=%s AND collection_date > %s
+        """, (int(loan_id), close_date))
+        cur.execute("""
+            UPDATE daily_collections
+            SET amount_paid=%s, status='Paid', updated_at=CURRENT_TIMESTAMP
+            WHERE id = (
+                SELECT id FROM daily_collections
+                WHERE loan_id=%s
+                ORDER BY collection_date DESC
+                LIMIT 1
+            )
+        """, (int(close_amount), int(loan_id)))
+    refresh_balances(cur, [loan_id])
+    notify(cur, "loans", "collections", f"loan:{loan_id}")
+
+
+def delete_customer(cur, customer_id, user=None):
+    # keep a copy of what is about to disappear
+    cur.execute("""
+        INSERT INTO audit_logs (action, customer_id, details, edited_by)
+        SELECT 'customer_delete', c.id,
+               jsonb_build_object(
+                   'customer', to_jsonb(c),
+                   'loans', (SELECT jsonb_agg(to_jsonb(l)) FROM loans l WHERE l.customer_id = c.id)
+               ),
+               %s
+        FROM customers c
+        WHERE c.id = %s
+    """, (user, int(customer_id)))
+    cur.execute("""
+        DELETE FROM daily_collections
+        WHERE loan_id IN (SELECT id FROM loans WHERE customer_id=%s)
+    """, (int(customer_id),))
+    cur.execute("""
+        DELETE FROM payments
+        WHERE loan_id IN (SELECT id FROM loans WHERE customer_id=%s)
+    """, (int(customer_id),))
+    cur.execute("""
+        DELETE FROM daily_collections_archive
+        WHERE loan_id IN (SELECT id FROM loans WHERE customer_id=%s)
+    """, (int(customer_id),))
+    cur.execute("""
+        DELETE FROM payments_archive
+        WHERE loan_id IN (SELECT id FROM loans WHERE customer_id=%s)
+    """, (int(customer_id),))
+    cur.execute("DELETE FROM loans WHERE customer_id=%s RETURNING id", (int(customer_id),))
+    loan_ids = [r[0] for r in cur.fetchall()]
+    cur.execute("DELETE FROM customers WHERE id=%s", (int(customer_id),))
+    notify(cur, "customers", "loans", "collections", *(f"loan:{i}" for i in loan_ids))
+
+
+def arrears_sql(paid):
+    """SQL for what an active loan l is behind by today, given its paid total:
+    one daily_amount per scheduled day up to today, minus what was paid."""
+    return f"""
+        CASE WHEN l.status = 'Active' THEN GREATEST(
+            l.daily_amount * GREATEST(LEAST(CURRENT_DATE, l.end_date) - l.start_date + 1, 0) - ({paid}),
+            0
+        ) ELSE 0 END
+    """
+
+
+def save_payments(cur, payments, user=None):
+    """Set the amount paid for many (loan, day) pairs in one statement.
+
+    Materialized loans get their daily_collections rows updated in place;
+    ledger loans get a payments row appended, but only where the amount
+    actually changes (the latest ledger row per day wins). The running
+    balances on loans are moved by the difference, and every real change
+    is written to audit_logs, all in the same statement.
+
+    payments: iterable of (loan_id, collection_date, amount_paid)
+    Returns the ids of the loans that were touched.
+    """
+    rows = {(int(l), d): int(a) for l, d, a in payments}
+    rows = [(l, d, a) for (l, d), a in rows.items()]
+    if not rows:
+        return set()
+    # ledger days have no row to lock: lock the loans instead (in id order,
+    # so concurrent batches cannot deadlock), otherwise two saves of the
+    # same day both read the same previous amount and paid_total counts twice
+    cur.execute(
+        "SELECT id, archived_at IS NOT NULL FROM loans WHERE id = ANY(%s) ORDER BY id FOR UPDATE",
+        (sorted({l for l, _, _ in rows}),)
+    )
+    # the same lock tells us which loans are archived, so the usual save
+    # pays no extra round trip for restoring them
+    archived = [l for l, is_archived in cur.fetchall() if is_archived]
+    if archived:
+        restore_archived(cur, archived)
+    # execute_values only takes the VALUES list, so the user goes in as a
+    # quoted literal (with % doubled for the placeholder parser)
+    edited_by = cur.mogrify("%s", (user,)).decode().replace("%", "%%")
+    touched = execute_values(cur, f"""
+        WITH v (loan_id, collection_date, amount) AS (VALUES %s),
+        old AS (
+            SELECT dc.id, dc.amount_paid
+            FROM daily_collections dc
+            JOIN v ON dc.loan_id = v.loan_id AND dc.collection_date = v.collection_date
+            FOR UPDATE OF dc
+        ),
+        upd AS (
+            UPDATE daily_collections dc
+            SET amount_paid = v.amount,
+                status = CASE WHEN v.amount > 0 THEN 'Paid' ELSE 'Pending' END,
+                updated_at = CURRENT_TIMESTAMP
+            FROM v, old
+            WHERE old.id = dc.id
+              AND dc.loan_id = v.loan_id AND dc.collection_date = v.collection_date
+            RETURNING dc.loan_id, dc.collection_date, old.amount_paid AS old_amount, v.amount AS new_amount
+        ),
+        prev AS (
+            SELECT v.loan_id, v.collection_date, v.amount, COALESCE((
+                SELECT p.amount_paid FROM payments p
+                WHERE p.loan_id = v.loan_id AND p.collection_date = v.collection_date
+                ORDER BY p.id DESC
+                LIMIT 1
+            ), 0) AS old_amount
+            FROM v
+            JOIN loans l ON l.id = v.loan_id AND l.schedule_mode = 'ledger'
+        ),
+        led AS (
+            INSERT INTO payments (loan_id, collection_date, amount_paid)
+            SELECT loan_id, collection_date, amount
+            FROM prev
+            WHERE amount IS DISTINCT FROM old_amount
+            RETURNING loan_id, collection_date
+        ),
+        changes AS (
+            SELECT loan_id, collection_date, old_amount, new_amount FROM upd
+            UNION ALL
+            SELECT p.loan_id, p.collection_date, p.old_amount, p.amount
+            FROM led JOIN prev p USING (loan_id, collection_date)
+        ),
+        aud AS (
+            INSERT INTO audit_logs (action, loan_id, collection_date, old_amount, new_amount, edited_by)
+            SELECT 'payment', loan_id, collection_date, old_amount, new_amount, {edited_by}
+            FROM changes
+            WHERE old_amount IS DISTINCT FROM new_amount
+        ),
+        bal AS (
+            UPDATE loans l
+            SET paid_total = l.paid_total + c.delta,
+                last_paid_date = GREATEST(l.last_paid_date, c.last_paid),
+                arrears = {arrears_sql("l.paid_total + c.delta")}
+            FROM (
+                SELECT loan_id,
+                       SUM(new_amount - old_amount) AS delta,
+                       MAX(collection_date) FILTER (WHERE new_amount > 0) AS last_paid,
+                       BOOL_OR(new_amount = 0 AND old_amount > 0) AS cleared
+                FROM changes
+                GROUP BY loan_id
+            ) c
+            WHERE l.id = c.loan_id
+            RETURNING l.id, c.cleared
+        )
+        SELECT id, cleared FROM bal
+    """, rows, template="(%s, %s::date, %s)", page_size=len(rows), fetch=True)
+
+    # a day that was paid was set back to zero: its loan's last paid day
+    # may have moved backwards, which the deltas above cannot tell
+    cleared = [loan_id for loan_id, was_cleared in touched if was_cleared]
+    if cleared:
+        refresh_balances(cur, cleared)
+    loan_ids = {loan_id for loan_id, _ in touched}
+    if loan_ids:
+        notify(cur, "collections", *(f"loan:{i}" for i in loan_ids))
+    return loan_ids
+
+
+def refresh_balances(cur, loan_ids=None):
+    """Recompute paid_total / last_paid_date / arrears from the schedule
+    history, for the given loans or for all of them."""
+    cur.execute(f"""
+        UPDATE loans l
+        SET paid_total = h.paid,
+            last_paid_date = h.last_paid,
+            arrears = {arrears_sql("h.paid")}
+        FROM (
+            SELECT l2.id,
+                   COALESCE(SUM(cs.amount_paid), 0) AS paid,
+                   MAX(cs.collection_date) FILTER (WHERE cs.amount_paid > 0) AS last_paid
+            FROM loans l2
+            LEFT JOIN LATERAL (
+                SELECT amount_paid, collection_date
+                FROM collection_schedule
+                WHERE loan_id = l2.id
+            ) cs ON true
+            WHERE %(ids)s::int[] IS NULL OR l2.id = ANY(%(ids)s::int[])
+            GROUP BY l2.id
+        ) h
+        WHERE l.id = h.id
+    """, {"ids": None if loan_ids is None else [int(i) for i in loan_ids]})
+    return cur.rowcount
+
+
+def roll_arrears(cur):
+    """Arrears grow by a day's installment every day without any write;
+    run this once a day (cron) to bring every active loan up to date."""
+    cur.execute(f"""
+        UPDATE loans l
+        SET arrears = {arrears_sql("l.paid_total")}
+        WHERE l.status = 'Active'
+    """)
+    n = cur.rowcount
+    notify(cur, "loans")
+    return n
+
+
+def convert_to_ledger(con, batch_size=200):
+    """Move materialized loans to the ledger layout, a batch of loans per
+    transaction: paid days become ledger rows, the schedule rows go."""
+    cur = con.cursor()
+    converted = 0
+    while True:
+        cur.execute("""
+            SELECT id FROM loans
+            WHERE schedule_mode = 'materialized' AND archived_at IS NULL
+            ORDER BY id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        """, (batch_size,))
+        ids = [r[0] for r in cur.fetchall()]
+        if not ids:
+            break
+
+        cur.execute("""
+            INSERT INTO payments (loan_id, collection_date, amount_paid, recorded_at)
+            SELECT loan_id, collection_date, amount_paid, updated_at
+            FROM daily_collections
+            WHERE loan_id = ANY(%s) AND amount_paid <> 0
+        """, (ids,))
+        # schedules that were cut short by hand keep their real last day
+        cur.execute("""
+            UPDATE loans l
+            SET end_date = s.last_day, schedule_mode = 'ledger', updated_at = CURRENT_TIMESTAMP
+            FROM (
+                SELECT l2.id, COALESCE(MAX(dc.collection_date), l2.end_date) AS last_day
+                FROM loans l2
+                LEFT JOIN daily_collections dc ON dc.loan_id = l2.id
+                WHERE l2.id = ANY(%s)
+                GROUP BY l2.id
+            ) s
+            WHERE l.id = s.id
+        """, (ids,))
+        cur.execute("DELETE FROM daily_collections WHERE loan_id = ANY(%s)", (ids,))
+        con.commit()
+
+        converted += len(ids)
+        print(f"\r{converted} loans converted", end="", flush=True)
+
+    cur.close()
+    return converted
+
+
+USAGE = """usage: python loans.py COMMAND
+  --to-ledger         convert materialized loans to the payments ledger
+  --repair-balances   recompute paid_total / last_paid_date / arrears from history
+  --roll-arrears      bring arrears of active loans up to today (run daily)"""
+
+
+if __name__ == "__main__":
+    from db import get_connection
+
+    conn = get_connection()
+    cur = conn.cursor()
+
+    if "--to-ledger" in sys.argv:
+        n = convert_to_ledger(conn)
+        print(f"\n✅ {n} loans now use the payments ledger")
+    elif "--repair-balances" in sys.argv:
+        n = refresh_balances(cur)
+        notify(cur, "loans")
+        conn.commit()
+        print(f"✅ Balances recomputed for {n} loans")
+    elif "--roll-arrears" in sys.argv:
+        n = roll_arrears(cur)
+        conn.commit()
+        print(f"✅ Arrears updated for {n} active loans")
+    else:
+        print(USAGE)
+        sys.exit(1)
+
+    conn.close()
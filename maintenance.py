@@ -0,0 +1,238 @@
+# =============================================================================
+# PARTITION MAINTENANCE AND ARCHIVAL OF CLOSED LOANS
+# =============================================================================
+# daily_collections is range-partitioned by month on collection_date (see
+# migration 12), so date-bound reads such as the Daily Collection page and
+# Reports only touch the months they ask for. Run daily from cron:
+#
+#   python maintenance.py --partitions    # create the coming months' partitions
+#   python maintenance.py --archive       # move old closed loans out of the hot tables
+#
+# The app also creates missing partitions when it starts, and rows for a
+# month that has no partition yet land in daily_collections_default until
+# one is created.
+
+import os
+import sys
+from datetime import date
+
+from db import PARTITION_LOCK
+
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "12"))
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "180"))
+ARCHIVE_BATCH = int(os.getenv("ARCHIVE_BATCH", "100"))
+
+
+def _add_months(month, n):
+    y, m = divmod(month.year * 12 + month.month - 1 + n, 12)
+    return date(y, m + 1, 1)
+
+
+def partition_name(month):
+    return f"daily_collections_y{month.year}m{month.month:02d}"
+
+
+def is_partitioned(cur):
+    cur.execute("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass('daily_collections')")
+    r = cur.fetchone()
+    return bool(r and r[0])
+
+
+def create_partition(cur, month):
+    """Add the partition for one month. Rows already sitting in the default
+    partition for that month are moved into it first, otherwise ATTACH
+    would refuse."""
+    name, upper = partition_name(month), _add_months(month, 1)
+    cur.execute(f"CREATE TABLE {name} (LIKE daily_collections INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+    cur.execute(f"""
+        WITH moved AS (
+            DELETE FROM daily_collections_default
+            WHERE collection_date >= %s AND collection_date < %s
+            RETURNING *
+        )
+        INSERT INTO {name} SELECT * FROM moved
+    """, (month, upper))
+    cur.execute(
+        f"ALTER TABLE daily_collections ATTACH PARTITION {name} "
+        f"FOR VALUES FROM ('{month}') TO ('{upper}')"
+    )
+
+
+def ensure_partitions(cur, start=None, end=None):
+    """Create every missing monthly partition from `start` (default: this
+    month) through `end` (default: PARTITION_MONTHS_AHEAD months on).
+    Returns the names created; does nothing while another process holds
+    the lock or before migration 12 has run."""
+    if not is_partitioned(cur):
+        return []
+    cur.execute("SELECT pg_try_advisory_xact_lock(%s)", (PARTITION_LOCK,))
+    if not cur.fetchone()[0]:
+        return []
+
+    today = date.today().replace(day=1)
+    month = (start or today).replace(day=1)
+    end = (end or _add_months(today, PARTITION_MONTHS_AHEAD)).replace(day=1)
+
+    cur.execute("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'daily_collections'::regclass
+    """)
+    existing = {r[0] for r in cur.fetchall()}
+
+    created = []
+    while month <= end:
+        if partition_name(month) not in existing:
+            create_partition(cur, month)
+            created.append(partition_name(month))
+        month = _add_months(month, 1)
+    return created
+
+
+def partition_daily_collections(cur):
+    """Rebuild daily_collections as a table partitioned by month, copying
+    every row (runs once, inside migration 12's transaction).
+
+    This is downtime: daily_collections is locked ACCESS EXCLUSIVE until
+    migration 12 commits, so every read and write of it and of the
+    collection_schedule view waits for the copy and the index builds. Run
+    the migration outside collection hours; expect roughly the time of a
+    full copy of the table plus two index builds."""
+    if is_partitioned(cur):
+        return
+    # the RENAME below needs this lock anyway; taking it first means no
+    # other session can slip in between and deadlock with the upgrade
+    cur.execute("LOCK TABLE daily_collections IN ACCESS EXCLUSIVE MODE")
+    cur.execute("SELECT MIN(collection_date), MAX(collection_date) FROM daily_collections")
+    first, last = cur.fetchone()
+
+    # the old table keeps serving the view until it is replaced further on
+    cur.execute("ALTER TABLE daily_collections RENAME TO daily_collections_unpartitioned")
+    # free the constraint names (daily_collections_pkey, ...) for the new table
+    cur.execute("""
+        SELECT conname FROM pg_constraint
+        WHERE conrelid = 'daily_collections_unpartitioned'::regclass
+          AND conname LIKE 'daily\\_collections\\_%'
+    """)
+    for (name,) in cur.fetchall():
+        cur.execute(
+            f'ALTER TABLE daily_collections_unpartitioned RENAME CONSTRAINT "{name}" '
+            f'TO "{name.replace("daily_collections", "daily_collections_unpartitioned", 1)}"'
+        )
+    cur.execute("""
+        CREATE TABLE daily_collections (
+            id INT NOT NULL DEFAULT nextval('daily_collections_id_seq'),
+            loan_id INT REFERENCES loans(id),
+            collection_date DATE NOT NULL,
+            amount_due INT,
+            amount_paid INT DEFAULT 0,
+            status VARCHAR(20),
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (id, collection_date)
+        ) PARTITION BY RANGE (collection_date)
+    """)
+    cur.execute("ALTER SEQUENCE daily_collections_id_seq OWNED BY daily_collections.id")
+    cur.execute("CREATE TABLE daily_collections_default PARTITION OF daily_collections DEFAULT")
+
+    today = date.today()
+    ensure_partitions(
+        cur,
+        start=min(first or today, today),
+        end=max(last or today, _add_months(today.replace(day=1), PARTITION_MONTHS_AHEAD)),
+    )
+    cur.execute("""
+        INSERT INTO daily_collections
+        SELECT id, loan_id, collection_date, amount_due, amount_paid, status, updated_at
+        FROM daily_collections_unpartitioned
+    """)
+
+
+def drop_unpartitioned(cur):
+    """drop the pre-partitioning copy of daily_collections"""
+    cur.execute("DROP TABLE IF EXISTS daily_collections_unpartitioned")
+
+
+# -----------------------------------------------------------------------------
+# ARCHIVAL
+# -----------------------------------------------------------------------------
+def archive_closed_loans(con, older_than_days=ARCHIVE_AFTER_DAYS, batch_size=ARCHIVE_BATCH):
+    """Move the schedules and payments of loans closed more than
+    `older_than_days` ago into the archive tables, `batch_size` loans per
+    short transaction. Locked loans are skipped and picked up next run.
+
+    The loans row itself stays (customer pages and the audit log refer to
+    it) and is only stamped with archived_at; the collection_schedule view
+    reads archived schedules from daily_collections_archive, so statements
+    and history look exactly the same afterwards.
+    """
+    cur = con.cursor()
+    archived = 0
+
+    while True:
+        cur.execute("""
+            SELECT id, start_date, end_date
+            FROM loans
+            WHERE status = 'Closed' AND archived_at IS NULL
+              AND end_date < CURRENT_DATE - %s
+            ORDER BY id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        """, (int(older_than_days), int(batch_size)))
+        picked = cur.fetchall()
+        if not picked:
+            break
+
+        ids = [r[0] for r in picked]
+        first = min(r[1] for r in picked)
+        last = max(r[2] for r in picked)
+
+        # the final schedule, whichever way it was stored
+        cur.execute("""
+            INSERT INTO daily_collections_archive
+            (loan_id, collection_date, amount_due, amount_paid, status, updated_at)
+            SELECT loan_id, collection_date, amount_due, amount_paid, status, updated_at
+            FROM collection_schedule
+            WHERE loan_id = ANY(%s)
+        """, (ids,))
+        # the date range lets the planner skip every other month
+        cur.execute("""
+            DELETE FROM daily_collections
+            WHERE loan_id = ANY(%s) AND collection_date BETWEEN %s AND %s
+        """, (ids, first, last))
+        cur.execute("""
+            WITH moved AS (DELETE FROM payments WHERE loan_id = ANY(%s) RETURNING *)
+            INSERT INTO payments_archive SELECT * FROM moved
+        """, (ids,))
+        cur.execute("UPDATE loans SET archived_at = CURRENT_TIMESTAMP WHERE id = ANY(%s)", (ids,))
+        con.commit()
+
+        archived += len(ids)
+        print(f"\r{archived} loans archived", end="", flush=True)
+
+    cur.close()
+    return archived
+
+
+USAGE = """usage: python maintenance.py COMMAND
+  --partitions   create daily_collections partitions for the coming months
+  --archive      move closed loans older than ARCHIVE_AFTER_DAYS to the archive tables"""
+
+
+if __name__ == "__main__":
+    from db import get_connection
+
+    conn = get_connection()
+
+    if "--partitions" in sys.argv:
+        created = ensure_partitions(conn.cursor())
+        conn.commit()
+        print(f"✅ {len(created)} partitions created" + (f": {', '.join(created)}" if created else ""))
+    elif "--archive" in sys.argv:
+        n = archive_closed_loans(conn)
+        print(f"\n✅ {n} closed loans archived")
+    else:
+        print(USAGE)
+        sys.exit(1)
+
+    conn.close()
@@ -0,0 +1,341 @@
+# =============================================================================
+# READ QUERIES SHARED BY THE APP AND SCRIPTS
+# =============================================================================
+
+from datetime import timedelta
+
+import pandas as pd
+
+
+def customer_schedules(con, customer_id):
+    """Schedules of every loan of a customer in one round trip, split per loan."""
+    hist = pd.read_sql("""
+        SELECT cs.loan_id, cs.collection_date, cs.amount_due, cs.amount_paid, cs.status
+        FROM collection_schedule cs
+        WHERE cs.loan_id = ANY(ARRAY(SELECT id FROM loans WHERE customer_id = %s))
+        ORDER BY cs.loan_id, cs.collection_date
+    """, con, params=(int(customer_id),))
+
+    empty = hist.iloc[0:0].drop(columns="loan_id")
+    by_loan = {
+        loan_id: g.drop(columns="loan_id").reset_index(drop=True)
+        for loan_id, g in hist.groupby("loan_id")
+    }
+    return by_loan, empty
+
+
+def customers_page(con, page_size, after=None):
+    """One page of the customer list, newest first.
+
+    Keyset pagination on (created_at, id): `after` is the (created_at, id) of
+    the last row of the previous page, so every page costs the same index
+    range scan no matter how deep the user has paged. One extra row is
+    fetched to tell whether a next page exists.
+    """
+    where, params = "", []
+    if after is not None:
+        where = "WHERE (c.created_at, c.id) < (%s, %s)"
+        params = [after[0], int(after[1])]
+
+    df = pd.read_sql(f"""
+        SELECT
+            c.id,
+            c.customer_code,
+            c.name,
+            c.mobile1,
+            c.created_at,
+            (SELECT COUNT(*) FROM loans l WHERE l.customer_id = c.id) AS total_loans
+        FROM customers c
+        {where}
+        ORDER BY c.created_at DESC, c.id DESC
+        LIMIT %s
+    """, con, params=(*params, int(page_size) + 1))
+
+    has_next = len(df) > page_size
+    return df.head(page_size), has_next
+
+
+def customers_estimate(con):
+    """Planner row estimate for customers; exact count only while the table
+    is small or has never been analysed."""
+    cur = con.cursor()
+    cur.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = 'customers'::regclass")
+    estimate = cur.fetchone()[0]
+    if estimate < 10000:
+        cur.execute("SELECT COUNT(*) FROM customers")
+        estimate = cur.fetchone()[0]
+    cur.close()
+    return estimate
+
+
+_trigram = None
+
+
+def has_trigram(con):
+    """Whether pg_trgm is installed; checked once per process."""
+    global _trigram
+    if _trigram is None:
+        cur = con.cursor()
+        cur.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        _trigram = cur.fetchone() is not None
+        cur.close()
+    return _trigram
+
+
+def search_customers(con, text, limit=20):
+    """Ranked type-ahead match on name, customer code and mobile numbers.
+
+    Exact code / mobile hits rank first, then prefix hits, then (with
+    pg_trgm) substring and fuzzy name matches by similarity. Every branch
+    of the WHERE is served by an index from migration 5.
+    """
+    q = text.strip().lower()
+    like = q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    phone = like.replace(" ", "").replace("-", "").lstrip("+")
+    params = {
+        "q": q,
+        "prefix": like + "%",
+        "mobile": (phone if phone.isdigit() else like) + "%",
+        "limit": int(limit),
+    }
+
+    if has_trigram(con):
+        match = """
+            lower(c.name) LIKE %(prefix)s OR lower(c.customer_code) LIKE %(prefix)s
+            OR c.mobile1 LIKE %(mobile)s OR c.second_mobile LIKE %(mobile)s
+            OR c.name ILIKE %(contains)s OR c.customer_code ILIKE %(contains)s
+            OR c.mobile1 LIKE %(contains)s OR c.second_mobile LIKE %(contains)s
+            OR c.name %% %(q)s
+        """
+        fuzzy = "GREATEST(similarity(c.name, %(q)s), similarity(c.customer_code, %(q)s))"
+        params["contains"] = f"%{like}%"
+    else:
+        match = """
+            lower(c.name) LIKE %(prefix)s OR lower(c.customer_code) LIKE %(prefix)s
+            OR c.mobile1 LIKE %(mobile)s OR c.second_mobile LIKE %(mobile)s
+        """
+        fuzzy = "0"
+
+    return pd.read_sql(f"""
+        SELECT
+            c.id,
+            c.customer_code,
+            c.name,
+            c.mobile1,
+            c.created_at,
+            (SELECT COUNT(*) FROM loans l WHERE l.customer_id = c.id) AS total_loans,
+            CASE
+                WHEN lower(c.customer_code) = %(q)s
+                  OR c.mobile1 = %(q)s OR c.second_mobile = %(q)s THEN 3
+                WHEN lower(c.name) LIKE %(prefix)s
+                  OR lower(c.customer_code) LIKE %(prefix)s
+                  OR c.mobile1 LIKE %(mobile)s OR c.second_mobile LIKE %(mobile)s THEN 2
+                ELSE 1
+            END + {fuzzy} AS rank
+        FROM customers c
+        WHERE {match}
+        ORDER BY rank DESC, c.name
+        LIMIT %(limit)s
+    """, con, params=params)
+
+
+def _month_after(d):
+    return (d.replace(day=1) + timedelta(days=32)).replace(day=1)
+
+
+def report_summary(con, from_date, to_date):
+    """KPIs, customer-wise and date-wise totals from the summary tables
+    (see summaries.py), so a range of many months costs the same few
+    hundred rows as a single day.
+
+    Both tables read the same sources: the summary tables (summary_daily,
+    summary_customer_month) for the whole months in the range, and the live
+    schedule for the odd days before and after them. The KPIs are the sums
+    of the customer-wise table, so all three agree.
+
+    Returns (totals, by_customer, by_date); totals is None when the range
+    has no schedule rows, otherwise it carries `summarized` (whether any
+    whole month came from the summary tables) and `as_of`, the time of the
+    last summary refresh.
+    """
+    # whole months [m_from, m_to); the days outside them are read live
+    m_from = from_date if from_date.day == 1 else _month_after(from_date)
+    m_to = _month_after(to_date) if (to_date + timedelta(days=1)).day == 1 else to_date.replace(day=1)
+    if m_from < m_to:
+        head = (from_date, m_from - timedelta(days=1))
+        tail = (m_to, to_date)
+    else:
+        m_from = m_to
+        head = (from_date, to_date)
+        tail = (to_date + timedelta(days=1), to_date)      # empty
+
+    by_customer = pd.read_sql("""
+        WITH parts AS (
+            SELECT customer_id, amount_due, amount_paid
+            FROM summary_customer_month
+            WHERE month >= %(m_from)s AND month < %(m_to)s
+            UNION ALL
+            SELECT l.customer_id, cs.amount_due, cs.amount_paid
+            FROM collection_schedule_between(%(head_from)s, %(head_to)s) cs
+            JOIN loans l ON l.id = cs.loan_id
+            UNION ALL
+            SELECT l.customer_id, cs.amount_due, cs.amount_paid
+            FROM collection_schedule_between(%(tail_from)s, %(tail_to)s) cs
+            JOIN loans l ON l.id = cs.loan_id
+        )
+        SELECT c.customer_code, c.name,
+               SUM(p.amount_due)::bigint AS amount_due, SUM(p.amount_paid)::bigint AS amount_paid,
+               (SELECT refreshed_at FROM summary_state WHERE name = 'collections') AS as_of
+        FROM parts p
+        JOIN customers c ON c.id = p.customer_id
+        GROUP BY c.customer_code, c.name
+        ORDER BY c.customer_code
+    """, con, params={
+        "m_from": m_from, "m_to": m_to,
+        "head_from": head[0], "head_to": head[1], "tail_from": tail[0], "tail_to": tail[1],
+    })
+    by_customer["pending"] = by_customer["amount_due"] - by_customer["amount_paid"]
+
+    by_date = pd.read_sql("""
+        SELECT collection_date, amount_due, amount_paid
+        FROM summary_daily
+        WHERE collection_date >= %(m_from)s AND collection_date < %(m_to)s
+        UNION ALL
+        SELECT collection_date, SUM(amount_due)::bigint, SUM(amount_paid)::bigint
+        FROM collection_schedule_between(%(head_from)s, %(head_to)s)
+        GROUP BY collection_date
+        UNION ALL
+        SELECT collection_date, SUM(amount_due)::bigint, SUM(amount_paid)::bigint
+        FROM collection_schedule_between(%(tail_from)s, %(tail_to)s)
+        GROUP BY collection_date
+        ORDER BY collection_date
+    """, con, params={
+        "m_from": m_from, "m_to": m_to,
+        "head_from": head[0], "head_to": head[1], "tail_from": tail[0], "tail_to": tail[1],
+    })
+    by_date["pending"] = by_date["amount_due"] - by_date["amount_paid"]
+
+    totals = None
+    if not by_customer.empty:
+        totals = pd.Series({
+            "amount_due": by_customer["amount_due"].sum(),
+            "amount_paid": by_customer["amount_paid"].sum(),
+            "pending": by_customer["pending"].sum(),
+            "customers_paid": int((by_customer["amount_paid"] > 0).sum()),
+            "summarized": m_from < m_to,
+            "as_of": by_customer["as_of"].iloc[0],
+        })
+    return totals, by_customer.drop(columns="as_of"), by_date
+
+
+def report_pending(con, from_date, to_date):
+    """Unpaid schedule rows in the range (detail, fetched on demand)."""
+    return pd.read_sql("""
+        SELECT cs.collection_date, c.customer_code, c.name, cs.amount_due
+        FROM collection_schedule_between(%s, %s) cs
+        JOIN loans l ON cs.loan_id = l.id
+        JOIN customers c ON l.customer_id = c.id
+        WHERE cs.amount_paid = 0
+        ORDER BY cs.collection_date, c.name
+    """, con, params=(from_date, to_date))
+
+
+def dashboard_kpis(con, today):
+    return pd.read_sql("""
+        SELECT
+        (SELECT COUNT(*) FROM customers) customers,
+        (SELECT COUNT(*) FROM loans WHERE status='Active') active,
+        (SELECT COALESCE(SUM(amount_paid),0)::bigint FROM summary_daily WHERE collection_date = %s) collected,
+        (SELECT refreshed_at FROM summary_state WHERE name = 'collections') as_of
+    """, con, params=(today,)).iloc[0]
+
+
+OVERDUE_BUCKETS = ["1-7 days", "8-30 days", "31-90 days", "90+ days"]
+
+
+def overdue_loans(con, today):
+    """Every active loan that is behind, riskiest first, in one pass over
+    loans: paid-to-date and the last paid day are kept on the loan
+    (paid_total / last_paid_date), so nothing has to scan the schedules.
+
+    Arrears are worked out here for `today` rather than read from
+    loans.arrears: that column only moves on a write or the --roll-arrears
+    job, so a loan that simply stopped paying would never show up.
+
+    days_overdue is the number of installments the arrears amount to;
+    missed_streak the scheduled days since the last payment.
+    """
+    return pd.read_sql("""
+        SELECT *,
+               CASE
+                   WHEN days_overdue <= 7 THEN '1-7 days'
+                   WHEN days_overdue <= 30 THEN '8-30 days'
+                   WHEN days_overdue <= 90 THEN '31-90 days'
+                   ELSE '90+ days'
+               END AS bucket
+        FROM (
+            SELECT
+                l.id AS loan_id,
+                c.customer_code,
+                c.name,
+                c.mobile1,
+                l.daily_amount,
+                l.end_date,
+                e.expected,
+                l.paid_total AS paid,
+                e.expected - l.paid_total AS arrears,
+                CEIL((e.expected - l.paid_total)::numeric / l.daily_amount)::int AS days_overdue,
+                GREATEST(e.upto - GREATEST(l.last_paid_date, l.start_date - 1), 0) AS missed_streak,
+                l.last_paid_date,
+                %(today)s::date > l.end_date AS past_end
+            FROM loans l
+            JOIN customers c ON c.id = l.customer_id
+            CROSS JOIN LATERAL (
+                SELECT LEAST(%(today)s::date, l.end_date) AS upto,
+                       l.daily_amount * GREATEST(LEAST(%(today)s::date, l.end_date) - l.start_date + 1, 0) AS expected
+            ) e
+            WHERE l.status = 'Active'
+              AND l.daily_amount > 0
+              AND e.expected > l.paid_total
+        ) o
+        ORDER BY days_overdue DESC, missed_streak DESC, arrears DESC
+    """, con, params={"today": today})
+
+
+def audit_log(con, from_date, to_date, loan_id=None, action=None, limit=500):
+    """Newest audit entries in a date range, optionally for one loan/action."""
+    where, params = ["a.edited_at >= %s", "a.edited_at < %s::date + 1"], [from_date, to_date]
+    if loan_id:
+        where.append("a.loan_id = %s")
+        params.append(int(loan_id))
+    if action:
+        where.append("a.action = %s")
+        params.append(action)
+
+    return pd.read_sql(f"""
+        SELECT a.edited_at, a.action, a.edited_by, a.loan_id, a.customer_id,
+               a.collection_date, a.old_amount, a.new_amount, a.details::text AS details
+        FROM audit_logs a
+        WHERE {" AND ".join(where)}
+        ORDER BY a.edited_at DESC
+        LIMIT %s
+    """, con, params=(*params, int(limit)))
+
+
+def collection_day(con, day):
+    """Schedule rows of active loans due on one day, with the customer."""
+    return pd.read_sql("""
+        SELECT
+            cs.loan_id,
+            cs.collection_date,
+            c.customer_code,
+            c.name,
+            cs.amount_due,
+            cs.amount_paid,
+            cs.status
+        FROM collection_schedule_between(%s, %s) cs
+        JOIN loans l ON cs.loan_id = l.id
+        JOIN customers c ON l.customer_id = c.id
+        WHERE l.status = 'Active'
+        ORDER BY c.name
+    """, con, params=(day, day))
@@ -0,0 +1,183 @@
+# =============================================================================
+# LOAN STATEMENT PDFs
+# =============================================================================
+
+import io
+import multiprocessing
+import os
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
+
+import pandas as pd
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfgen import canvas
+
+# rendered statements are keyed on their content, so they can live long
+STATEMENT_CACHE_TTL = float(os.getenv("STATEMENT_CACHE_TTL", "86400"))
+
+
+def loan_pdf(customer, loan, hist):
+    buf = io.BytesIO()
+    pdf = canvas.Canvas(buf, pagesize=A4)
+    y = A4[1] - 40
+
+    pdf.setFont("Helvetica-Bold", 16)
+    pdf.drawString(40, y, "GANAPATHI FINANCE – LOAN STATEMENT")
+    y -= 30
+
+    pdf.setFont("Helvetica", 10)
+    pdf.drawString(40, y, f"Customer: {customer['name']} ({customer['customer_code']})")
+    y -= 14
+    pdf.drawString(40, y, f"Loan Amount: ₹{loan['total_amount']} | Status: {loan['status']}")
+    y -= 20
+
+    pdf.setFont("Helvetica-Bold", 10)
+    pdf.drawString(40, y, "Date")
+    pdf.drawString(160, y, "Due")
+    pdf.drawString(230, y, "Paid")
+    pdf.drawString(300, y, "Status")
+    y -= 12
+
+    pdf.setFont("Helvetica", 10)
+    for r in hist.itertuples(index=False):
+        if y < 60:
+            pdf.showPage()
+            y = A4[1] - 40
+        pdf.drawString(40, y, str(r.collection_date))
+        pdf.drawString(160, y, f"₹{r.amount_due}")
+        pdf.drawString(230, y, f"₹{r.amount_paid}")
+        pdf.drawString(300, y, r.status)
+        y -= 12
+
+    pdf.save()
+    buf.seek(0)
+    return buf
+
+
+def statement_version(customer, loan, hist):
+    """Fingerprint of everything printed on the statement; changes whenever
+    the customer header, the loan or any of its schedule rows does."""
+    fields = (customer["name"], customer["customer_code"], loan["status"], loan["total_amount"])
+    return hash(fields), int(pd.util.hash_pandas_object(hist, index=False).sum())
+
+
+# -----------------------------------------------------------------------------
+# BULK EXPORT
+# -----------------------------------------------------------------------------
+EXPORT_WORKERS = int(os.getenv("EXPORT_WORKERS", str(os.cpu_count() or 2)))
+STATEMENT_COLUMNS = ["collection_date", "amount_due", "amount_paid", "status"]
+
+
+def _selection(status, loan_ids):
+    if loan_ids:
+        return "l.id = ANY(%s)", [list(map(int, loan_ids))]
+    return "l.status = %s", [status]
+
+
+def count_statements(con, status="Active", loan_ids=None):
+    where, params = _selection(status, loan_ids)
+    cur = con.cursor()
+    cur.execute(f"SELECT COUNT(*) FROM loans l WHERE {where}", params)
+    total = cur.fetchone()[0]
+    cur.close()
+    return total
+
+
+def iter_statement_inputs(con, status="Active", loan_ids=None, itersize=5000):
+    """Stream (customer, loan, rows) for every selected loan in one ordered
+    pass over a server-side cursor, so only one loan is held at a time."""
+    where, params = _selection(status, loan_ids)
+    cur = con.cursor(name="statement_export")
+    cur.itersize = itersize
+    cur.execute(f"""
+        SELECT l.id, l.total_amount, l.status, c.name, c.customer_code,
+               cs.collection_date, cs.amount_due, cs.amount_paid, cs.status
+        FROM loans l
+        JOIN customers c ON l.customer_id = c.id
+        LEFT JOIN collection_schedule cs ON cs.loan_id = l.id
+        WHERE {where}
+        ORDER BY l.id, cs.collection_date
+    """, params)
+
+    current, rows = None, []
+    for r in cur:
+        if current is not None and r[0] != current[1]["id"]:
+            yield current[0], current[1], rows
+            rows = []
+        if current is None or r[0] != current[1]["id"]:
+            current = (
+                {"name": r[3], "customer_code": r[4]},
+                {"id": r[0], "total_amount": r[1], "status": r[2]},
+            )
+        if r[5] is not None:
+            rows.append(r[5:])
+    if current is not None:
+        yield current[0], current[1], rows
+    cur.close()
+
+
+def _render_statement(args):
+    customer, loan, rows = args
+    hist = pd.DataFrame(rows, columns=STATEMENT_COLUMNS)
+    name = f"{customer['customer_code']}_loan_{loan['id']}.pdf".replace("/", "-")
+    return name, loan_pdf(customer, loan, hist).getvalue()
+
+
+def export_statements(con, out, status="Active", loan_ids=None, workers=EXPORT_WORKERS, progress=None):
+    """Render statements in a process pool and write them into one ZIP as
+    they finish. At most a few loans per worker are in flight, so memory
+    stays flat however many loans are selected.
+
+    progress(done, total) is called after every statement.
+    """
+    total = count_statements(con, status, loan_ids)
+    inputs = iter_statement_inputs(con, status, loan_ids)
+    done = 0
+
+    # spawned, not forked: the app process runs Streamlit's threads, the
+    # cache listener and a connection pool, none of which survive a fork
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool, \
+            zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as zf:
+        pending = set()
+        for item in inputs:
+            pending.add(pool.submit(_render_statement, item))
+            if len(pending) >= workers * 4:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for f in finished:
+                    zf.writestr(*f.result())
+                    done += 1
+                    if progress:
+                        progress(done, total)
+        for f in as_completed(pending):
+            zf.writestr(*f.result())
+            done += 1
+            if progress:
+                progress(done, total)
+
+    return done
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    from db import get_connection
+
+    parser = argparse.ArgumentParser(description="Export loan statements into a ZIP")
+    parser.add_argument("--out", default="statements.zip")
+    parser.add_argument("--status", default="Active")
+    parser.add_argument("--loan", type=int, action="append", help="loan id (repeatable)")
+    parser.add_argument("--workers", type=int, default=EXPORT_WORKERS)
+    args = parser.parse_args()
+
+    started = time.monotonic()
+
+    def report(done, total):
+        if done % 50 == 0 or done == total:
+            rate = done / max(time.monotonic() - started, 1e-9) * 60
+            print(f"\r{done}/{total} statements | {rate:.0f}/min", end="", flush=True)
+
+    conn = get_connection()
+    n = export_statements(conn, args.out, args.status, args.loan, args.workers, report)
+    conn.close()
+    print(f"\n✅ {n} statements written to {args.out}")
@@ -0,0 +1,264 @@
+# =============================================================================
+# INCREMENTAL SUMMARY TABLES
+# =============================================================================
+# Dashboard and report totals are read from three summary tables instead of
+# being added up from the schedules on every view:
+#
+#   summary_daily            one row per day: due / paid / loans due / loans paid
+#   summary_customer_month   one row per customer per month: due / paid
+#   summary_loans            one row per loan: schedule range, due / paid to date
+#
+# `python summaries.py` (a required scheduled job, every minute or so, see
+# README.md) only revisits what changed since the last run, found from a
+# watermark on the write timestamps:
+# daily_collections.updated_at, payments.recorded_at and loans.updated_at
+# (loans created, edited, closed or converted), plus summary_loans rows whose
+# loan has been deleted. The affected days, customer-months and loans are
+# then recomputed from collection_schedule, so a refresh costs what changed,
+# not the size of the book.
+
+import os
+import sys
+import time
+
+from cache import notify
+from db import SUMMARY_LOCK
+
+SUMMARY_REFRESH_EVERY = float(os.getenv("SUMMARY_REFRESH_EVERY", "60"))
+# how far back an open transaction may hold the watermark, in seconds; a
+# session left idle in a transaction would otherwise make every run revisit
+# everything since it began (rows it writes later still need --full)
+SUMMARY_MAX_LOOKBACK = float(os.getenv("SUMMARY_MAX_LOOKBACK", "3600"))
+
+
+def _month(d):
+    return d.replace(day=1)
+
+
+def _rebuild(cur):
+    cur.execute("TRUNCATE summary_daily, summary_customer_month, summary_loans")
+    cur.execute("""
+        INSERT INTO summary_loans (loan_id, customer_id, first_date, last_date, amount_due, amount_paid)
+        SELECT l.id, l.customer_id, l.start_date, l.end_date,
+               COALESCE(SUM(cs.amount_due), 0), COALESCE(SUM(cs.amount_paid), 0)
+        FROM loans l
+        LEFT JOIN collection_schedule cs ON cs.loan_id = l.id
+        GROUP BY l.id
+    """)
+    cur.execute("""
+        INSERT INTO summary_customer_month (customer_id, month, amount_due, amount_paid)
+        SELECT l.customer_id, date_trunc('month', cs.collection_date)::date,
+               SUM(cs.amount_due), SUM(cs.amount_paid)
+        FROM collection_schedule cs
+        JOIN loans l ON l.id = cs.loan_id
+        GROUP BY 1, 2
+    """)
+    cur.execute("""
+        INSERT INTO summary_daily (collection_date, amount_due, amount_paid, loans_due, loans_paid)
+        SELECT collection_date, SUM(amount_due), SUM(amount_paid),
+               COUNT(*), COUNT(*) FILTER (WHERE amount_paid > 0)
+        FROM collection_schedule
+        GROUP BY collection_date
+    """)
+
+
+def _collect_changes(cur, since):
+    """Fill the dirty_* temp tables with what changed at or after `since`."""
+    cur.execute("""
+        CREATE TEMP TABLE dirty_loans (loan_id INT PRIMARY KEY) ON COMMIT DROP;
+        CREATE TEMP TABLE dirty_days (loan_id INT, collection_date DATE) ON COMMIT DROP;
+    """)
+    # single days: payments saved on either kind of schedule
+    cur.execute("""
+        INSERT INTO dirty_days
+        SELECT loan_id, collection_date FROM daily_collections WHERE updated_at >= %(since)s
+        UNION
+        SELECT loan_id, collection_date FROM payments WHERE recorded_at >= %(since)s
+    """, {"since": since})
+    # whole schedules: loans created / edited / closed since, and deleted
+    # ones, over both the range summarized last time and the current one
+    cur.execute("""
+        WITH changed AS (
+            SELECT id AS loan_id FROM loans WHERE updated_at >= %(since)s
+            UNION
+            SELECT s.loan_id FROM summary_loans s
+            WHERE NOT EXISTS (SELECT 1 FROM loans l WHERE l.id = s.loan_id)
+        ),
+        ranges AS (
+            SELECT c.loan_id, l.start_date AS first_date, l.end_date AS last_date
+            FROM changed c JOIN loans l ON l.id = c.loan_id
+            UNION ALL
+            SELECT c.loan_id, s.first_date, s.last_date
+            FROM changed c JOIN summary_loans s ON s.loan_id = c.loan_id
+        )
+        INSERT INTO dirty_days
+        SELECT DISTINCT r.loan_id, d::date
+        FROM ranges r
+        CROSS JOIN generate_series(r.first_date, r.last_date, interval '1 day') d
+    """, {"since": since})
+    cur.execute("INSERT INTO dirty_loans SELECT DISTINCT loan_id FROM dirty_days")
+
+
+def _apply_changes(cur):
+    """Recompute the dirty days, customer-months and loans. Returns the
+    number of days recomputed."""
+    # customer-months, keyed by the customer the loan had when it was last
+    # summarized as well as the one it has now (deleted loans have only the
+    # first); the LATERAL filters on loan_id reach into both branches of the
+    # collection_schedule view, a plain join would scan all of it
+    cur.execute("""
+        CREATE TEMP TABLE dirty_months ON COMMIT DROP AS
+        SELECT DISTINCT x.customer_id, date_trunc('month', d.collection_date)::date AS month
+        FROM dirty_days d
+        JOIN (
+            SELECT id AS loan_id, customer_id FROM loans
+            UNION
+            SELECT loan_id, customer_id FROM summary_loans
+        ) x ON x.loan_id = d.loan_id
+    """)
+    cur.execute("""
+        DELETE FROM summary_customer_month s
+        USING dirty_months m
+        WHERE s.customer_id = m.customer_id AND s.month = m.month
+    """)
+    cur.execute("""
+        INSERT INTO summary_customer_month (customer_id, month, amount_due, amount_paid)
+        SELECT m.customer_id, m.month, SUM(cs.due), SUM(cs.paid)
+        FROM dirty_months m
+        JOIN loans l ON l.customer_id = m.customer_id
+        CROSS JOIN LATERAL (
+            SELECT SUM(amount_due) AS due, SUM(amount_paid) AS paid, COUNT(*) AS n
+            FROM collection_schedule
+            WHERE loan_id = l.id
+              AND collection_date >= m.month
+              AND collection_date < (m.month + interval '1 month')::date
+        ) cs
+        GROUP BY m.customer_id, m.month
+        HAVING SUM(cs.n) > 0
+    """)
+
+    cur.execute("DELETE FROM summary_loans WHERE loan_id IN (SELECT loan_id FROM dirty_loans)")
+    cur.execute("""
+        INSERT INTO summary_loans (loan_id, customer_id, first_date, last_date, amount_due, amount_paid)
+        SELECT l.id, l.customer_id, l.start_date, l.end_date,
+               COALESCE(cs.due, 0), COALESCE(cs.paid, 0)
+        FROM dirty_loans d
+        JOIN loans l ON l.id = d.loan_id
+        CROSS JOIN LATERAL (
+            SELECT SUM(amount_due) AS due, SUM(amount_paid) AS paid
+            FROM collection_schedule
+            WHERE loan_id = l.id
+        ) cs
+    """)
+
+    # days, a month at a time so collection_schedule_between only touches
+    # that month's partition
+    cur.execute("SELECT DISTINCT collection_date FROM dirty_days ORDER BY 1")
+    days = [r[0] for r in cur.fetchall()]
+    cur.execute("DELETE FROM summary_daily WHERE collection_date = ANY(%s)", (days,))
+    by_month = {}
+    for d in days:
+        by_month.setdefault(_month(d), []).append(d)
+    for month_days in by_month.values():
+        cur.execute("""
+            INSERT INTO summary_daily (collection_date, amount_due, amount_paid, loans_due, loans_paid)
+            SELECT collection_date, SUM(amount_due), SUM(amount_paid),
+                   COUNT(*), COUNT(*) FILTER (WHERE amount_paid > 0)
+            FROM collection_schedule_between(%s, %s)
+            WHERE collection_date = ANY(%s)
+            GROUP BY collection_date
+        """, (month_days[0], month_days[-1], month_days))
+    return len(days)
+
+
+def refresh(cur, full=False):
+    """Bring the summary tables up to date, in the caller's transaction.
+
+    Returns the number of days recomputed, or None when another process is
+    refreshing right now. The caller commits.
+    """
+    cur.execute("SELECT pg_try_advisory_xact_lock(%s)", (SUMMARY_LOCK,))
+    if not cur.fetchone()[0]:
+        return None
+
+    cur.execute("SELECT watermark FROM summary_state WHERE name = 'collections' FOR UPDATE")
+    row = cur.fetchone()
+    since = None if full or row is None else row[0]
+
+    # rows stamped by transactions that are still open (CURRENT_TIMESTAMP is
+    # their start time) become visible later, so the next run starts no
+    # later than the oldest of them: only app sessions on this database can
+    # write these tables, and none is waited for longer than the lookback
+    cur.execute("""
+        SELECT GREATEST(
+            LEAST(LOCALTIMESTAMP, MIN(xact_start)::timestamp),
+            LOCALTIMESTAMP - make_interval(secs => %s)
+        )
+        FROM pg_stat_activity
+        WHERE xact_start IS NOT NULL AND pid <> pg_backend_pid()
+          AND backend_type = 'client backend' AND datname = current_database()
+    """, (SUMMARY_MAX_LOOKBACK,))
+    watermark = cur.fetchone()[0]
+
+    if since is None:
+        _rebuild(cur)
+        cur.execute("SELECT COUNT(*) FROM summary_daily")
+        days = cur.fetchone()[0]
+    else:
+        _collect_changes(cur, since)
+        days = _apply_changes(cur)
+
+    cur.execute("""
+        INSERT INTO summary_state (name, watermark, refreshed_at)
+        VALUES ('collections', %s, CURRENT_TIMESTAMP)
+        ON CONFLICT (name) DO UPDATE
+        SET watermark = EXCLUDED.watermark, refreshed_at = EXCLUDED.refreshed_at
+    """, (watermark,))
+    if days:
+        notify(cur, "summaries")
+    return days
+
+
+def build_summaries(cur):
+    """build the summary tables from the full history"""
+    refresh(cur, full=True)
+
+
+USAGE = """usage: python summaries.py [--full] [--every SECONDS]
+  (no flag)   recompute only what changed since the last run
+  --full      rebuild every summary from scratch
+  --every N   keep refreshing every N seconds (default SUMMARY_REFRESH_EVERY)"""
+
+
+if __name__ == "__main__":
+    from db import get_connection
+
+    if "-h" in sys.argv or "--help" in sys.argv:
+        print(USAGE)
+        sys.exit(0)
+
+    every = None
+    if "--every" in sys.argv:
+        args = sys.argv[sys.argv.index("--every") + 1:]
+        every = float(args[0]) if args and not args[0].startswith("-") else SUMMARY_REFRESH_EVERY
+
+    conn = get_connection()
+    cur = conn.cursor()
+    full = "--full" in sys.argv
+
+    while True:
+        started = time.monotonic()
+        days = refresh(cur, full=full)
+        conn.commit()
+        took = time.monotonic() - started
+        if days is None:
+            print("ℹ️ Another refresh is running")
+        else:
+            print(f"✅ {days} days {'rebuilt' if full else 'refreshed'} in {took:.2f}s", flush=True)
+
+        if every is None:
+            break
+        full = False
+        time.sleep(max(every - took, 0))
+
+    conn.close()
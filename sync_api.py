@@ -0,0 +1,227 @@
+# =============================================================================
+# PAYMENT SYNC API FOR FIELD COLLECTORS
+# =============================================================================
+# A small HTTP endpoint that runs next to the Streamlit app:
+#
+#   python sync_api.py                       # SYNC_API_HOST:SYNC_API_PORT
+#
+#   POST /payments   (HTTP Basic auth with an app login)
+#   {"payments": [
+#       {"key": "<client uuid>", "id": 1234, "amount_paid": 100},
+#       {"key": "<client uuid>", "loan_id": 7, "collection_date": "2026-10-18", "amount_paid": 100}
+#   ]}
+#
+# A whole batch is applied in one transaction with one bulk save_payments()
+# statement. Every item carries a client-generated idempotency key that is
+# stored in sync_keys together with the payment, so an upload retried after
+# a dropped connection reports the earlier result instead of posting again.
+# The response has one result per item, in request order:
+#   applied | duplicate | rejected (with an error)
+
+import base64
+import hashlib
+import json
+import os
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from psycopg2.extras import execute_values
+
+from db import get_connection
+from loans import save_payments
+
+SYNC_API_HOST = os.getenv("SYNC_API_HOST", "127.0.0.1")
+SYNC_API_PORT = int(os.getenv("SYNC_API_PORT", "8502"))
+SYNC_MAX_BATCH = int(os.getenv("SYNC_MAX_BATCH", "5000"))
+SYNC_MAX_BODY = 4 * 1024 * 1024
+
+
+def authenticate(cur, header):
+    """Username for a valid `Authorization: Basic ...` header, else None."""
+    if not header or not header.startswith("Basic "):
+        return None
+    try:
+        user, _, password = base64.b64decode(header[6:]).decode().partition(":")
+    except ValueError:
+        return None
+    cur.execute("SELECT password_hash FROM users WHERE username=%s", (user,))
+    r = cur.fetchone()
+    if r and r[0] == hashlib.sha256(password.encode()).hexdigest():
+        return user
+    return None
+
+
+def _parse(item):
+    """(key, id, loan_id, collection_date, amount) or raises ValueError."""
+    if not isinstance(item, dict):
+        raise ValueError("item must be an object")
+    key = str(item.get("key") or "").strip()
+    if not key or len(key) > 100:
+        raise ValueError("key is required (at most 100 characters)")
+    amount = item.get("amount_paid")
+    if not isinstance(amount, int) or isinstance(amount, bool) or amount < 0:
+        raise ValueError("amount_paid must be a whole number ≥ 0")
+    if item.get("id") is not None:
+        return key, int(item["id"]), None, None, amount
+    if item.get("loan_id") is None or not item.get("collection_date"):
+        raise ValueError("id or loan_id + collection_date is required")
+    return key, None, int(item["loan_id"]), date.fromisoformat(item["collection_date"]), amount
+
+
+def apply_batch(con, items, user=None):
+    """Apply a batch of payments in one transaction; returns one result
+    dict per item, in order."""
+    results = [{"key": item.get("key") if isinstance(item, dict) else None} for item in items]
+    parsed = {}                                 # position -> [key, id, loan_id, date, amount]
+    for n, item in enumerate(items):
+        try:
+            parsed[n] = list(_parse(item))
+        except (ValueError, TypeError) as e:
+            results[n].update(status="rejected", error=str(e))
+
+    def reject(n, error):
+        results[n].update(status="rejected", error=error)
+        del parsed[n]
+
+    cur = con.cursor()
+
+    # daily_collections ids -> (loan, day)
+    ids = [p[1] for p in parsed.values() if p[1] is not None]
+    if ids:
+        cur.execute("SELECT id, loan_id, collection_date FROM daily_collections WHERE id = ANY(%s)", (ids,))
+        rows = {r[0]: r[1:] for r in cur.fetchall()}
+        for n, p in list(parsed.items()):
+            if p[1] is None:
+                continue
+            if p[1] not in rows:
+                reject(n, "unknown id")
+            else:
+                p[2], p[3] = rows[p[1]]
+
+    # every payment must fall on a scheduled day of an active loan
+    if parsed:
+        cur.execute("""
+            SELECT v.loan_id, v.collection_date, l.status
+            FROM unnest(%s::int[], %s::date[]) AS v (loan_id, collection_date)
+            JOIN loans l ON l.id = v.loan_id
+            WHERE v.collection_date BETWEEN l.start_date AND l.end_date
+        """, ([p[2] for p in parsed.values()], [p[3] for p in parsed.values()]))
+        scheduled = {(r[0], r[1]): r[2] for r in cur.fetchall()}
+        for n, p in list(parsed.items()):
+            status = scheduled.get((p[2], p[3]))
+            if status is None:
+                reject(n, "no collection scheduled for this loan on this date")
+            elif status != "Active":
+                reject(n, f"loan is {status.lower()}")
+
+    # the same key twice in one batch counts once, like a retry would
+    first = {}
+    for n, p in parsed.items():
+        first.setdefault(p[0], n)
+
+    fresh = set()
+    if first:
+        fresh = {r[0] for r in execute_values(cur, """
+            INSERT INTO sync_keys (idempotency_key, loan_id, collection_date, amount_paid, edited_by)
+            VALUES %s
+            ON CONFLICT (idempotency_key) DO NOTHING
+            RETURNING idempotency_key
+        """, [(p[0], p[2], p[3], p[4], user) for n, p in parsed.items() if first[p[0]] == n],
+            page_size=len(first), fetch=True)}
+
+    seen = {}
+    dupes = [k for k in first if k not in fresh]
+    if dupes:
+        cur.execute("""
+            SELECT idempotency_key, loan_id, collection_date, amount_paid, received_at
+            FROM sync_keys WHERE idempotency_key = ANY(%s)
+        """, (dupes,))
+        seen = {r[0]: r[1:] for r in cur.fetchall()}
+
+    to_save = []
+    for n, p in parsed.items():
+        key = p[0]
+        if key in fresh and first[key] == n:
+            to_save.append((p[2], p[3], p[4]))
+            results[n].update(status="applied", loan_id=p[2], collection_date=str(p[3]), amount_paid=p[4])
+        else:
+            # stored by an earlier request, or applied just above
+            loan_id, day, amount, received = seen.get(key) or (*parsed[first[key]][2:], None)
+            results[n].update(
+                status="duplicate", loan_id=loan_id, collection_date=str(day), amount_paid=amount,
+                received_at=received.isoformat() if received else None,
+            )
+
+    save_payments(cur, to_save, user=user)
+    con.commit()
+    cur.close()
+    return results
+
+
+class SyncHandler(BaseHTTPRequestHandler):
+    server_version = "FinanceSync/1.0"
+
+    def _reply(self, code, body, headers=()):
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in headers:
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._reply(200, {"ok": True})
+        else:
+            self._reply(404, {"error": "not found"})
+
+    def do_POST(self):
+        if self.path != "/payments":
+            return self._reply(404, {"error": "not found"})
+
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            return self._reply(400, {"error": "invalid Content-Length"})
+        if length > SYNC_MAX_BODY:
+            return self._reply(413, {"error": "request too large"})
+        try:
+            body = json.loads(self.rfile.read(length) or b"null")
+        except ValueError:
+            return self._reply(400, {"error": "body is not valid JSON"})
+        items = body.get("payments") if isinstance(body, dict) else body
+        if not isinstance(items, list):
+            return self._reply(400, {"error": "expected {\"payments\": [...]}"})
+        if len(items) > SYNC_MAX_BATCH:
+            return self._reply(413, {"error": f"at most {SYNC_MAX_BATCH} payments per request"})
+
+        con = get_connection()
+        try:
+            user = authenticate(con.cursor(), self.headers.get("Authorization"))
+            if user is None:
+                return self._reply(401, {"error": "login required"},
+                                   [("WWW-Authenticate", 'Basic realm="collections"')])
+            results = apply_batch(con, items, user)
+        except Exception as e:
+            # the transaction is rolled back when the connection goes back
+            # to the pool, so nothing of this batch was saved
+            self.log_error("sync failed: %s", e)
+            return self._reply(500, {"error": "sync failed, nothing was saved – retry later"})
+        finally:
+            con.close()
+
+        counts = {s: sum(r.get("status") == s for r in results) for s in ("applied", "duplicate", "rejected")}
+        self._reply(200, {"results": results, **counts})
+
+
+if __name__ == "__main__":
+    server = ThreadingHTTPServer((SYNC_API_HOST, SYNC_API_PORT), SyncHandler)
+    print(f"✅ Payment sync API on http://{SYNC_API_HOST}:{SYNC_API_PORT}/payments")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()